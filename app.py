@@ -1,67 +1,109 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Query
+from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response
 import uvicorn
-from nodes.generators import rag_generate, plain_answer
-from nodes.retrievers import web_search, retrieve
-from nodes.graders import route_question, retrieval_grade, route_retrieval, grade_rag_generation, update_web_search, update_rag_generate
+from nodes.generators import rag_generate, plain_answer, ANSWER_STREAM_TAG
+from nodes.retrievers import web_search, retrieve, SpeculativeRetrieval, SPECULATIVE_KEY
+from nodes.graders import route_question, retrieval_grade, route_retrieval, grade_rag_generation, update_web_search, update_rag_generate, grade_question
 from models.state import GraphState
 from langgraph.graph import StateGraph, END
-from psycopg_pool import ConnectionPool
-from config.config import DB_URI
+from psycopg_pool import AsyncConnectionPool
+from config.config import (
+    DB_URI,
+    SEMANTIC_CACHE_ENABLED,
+    FAST_ROUTER_ENABLED,
+    MODERATION_ENABLED,
+    CHECKPOINT_DURABILITY,
+    CHECKPOINT_BACKEND
+)
+from data.data import init_retriever, get_index_version
+from services.semantic_cache import SemanticCache
+from services.history import create_history_store, DEFAULT_SESSION
+from services.checkpoints import WriteBehindSaver, create_write_behind_saver, create_checkpoint_pruner
+from services.llm import close_llm_clients
+from services.fast_router import fast_router
+from services.moderation import pre_moderator
+from services.cassette import get_cassette
+from services.metrics import instrument_node, instrument_router, metrics_callback
+from services.log import setup_logging, get_logger
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from contextlib import asynccontextmanager
 from typing import List
 from datetime import datetime
-from langgraph.checkpoint.postgres import PostgresSaver
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+import asyncio
 import json
+import uuid
+
+setup_logging()
+logger = get_logger(__name__)
 
 # 添加全局連接池
 _pool = None
 
+# 串流時回報進度的節點與路由
+STREAM_NODES = {"retrieve", "web_search", "retrieval_grade",
+                "rag_generate", "plain_answer"}
+STREAM_ROUTERS = {"route_question", "route_retrieval", "grade_rag_generation"}
+GENERATION_NODES = {"rag_generate", "plain_answer"}
+
+# 已編譯工作流程註冊表，於應用啟動時建立並由所有請求共用
+_workflows = {}
 
-def get_connection_pool():
-    """獲取全局連接池"""
+
+async def get_connection_pool():
+    """獲取全局非同步連接池"""
     global _pool
     if _pool is None:
-        _pool = ConnectionPool(
+        _pool = AsyncConnectionPool(
             conninfo=DB_URI,
             max_size=20,
             kwargs={
                 "autocommit": True,
                 "prepare_threshold": 0,
             },
+            open=False,
         )
+        await _pool.open()
     return _pool
 
 
-def create_postgres_saver():
+# 語意答案快取
+semantic_cache = SemanticCache(get_connection_pool)
+
+# 對話歷史，背景批次寫入
+history = create_history_store(get_connection_pool)
+
+# 定期刪除過期的 checkpoint
+checkpoint_pruner = create_checkpoint_pruner(get_connection_pool)
+
+
+async def create_postgres_saver():
     try:
-        pool = get_connection_pool()
-        postgres_saver = PostgresSaver(pool)
-        postgres_saver.setup()
+        pool = await get_connection_pool()
+        postgres_saver = AsyncPostgresSaver(pool)
+        await postgres_saver.setup()
         return postgres_saver
     except Exception as e:
-        print(f"創建 PostgresSaver 時發生錯誤: {str(e)}")
+        logger.exception(f"創建 PostgresSaver 時發生錯誤: {str(e)}")
         raise
 
 
-def setup_database():
-    """設置資料庫表格"""
+async def create_checkpointer():
+    """依 CHECKPOINT_BACKEND 建立 checkpointer，memory 時在記憶體保存並背景寫入 Postgres"""
+    postgres_saver = await create_postgres_saver()
+    if CHECKPOINT_BACKEND == "memory":
+        return create_write_behind_saver(postgres_saver)
+    return postgres_saver
+
+
+async def setup_database():
+    """設置資料庫表格並啟動對話歷史的背景寫入"""
     try:
-        pool = get_connection_pool()
-        with pool.connection() as conn:
-            with conn.cursor() as cur:
-                # 創建對話歷史表格
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS conversation_history (
-                        conversation_id TEXT PRIMARY KEY,
-                        state JSONB,
-                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                conn.commit()
+        await history.setup()
     except Exception as e:
-        print(f"設置資料庫時發生錯誤: {str(e)}")
+        logger.exception(f"設置資料庫時發生錯誤: {str(e)}")
         raise
 
 
@@ -69,10 +111,33 @@ def setup_database():
 async def lifespan(app: FastAPI):
     """應用程式生命週期管理"""
     global _pool
-    setup_database()  # 在應用啟動時創建表格
+    await setup_database()  # 在應用啟動時創建表格
+    await asyncio.to_thread(init_retriever)  # 在應用啟動時載入向量索引
+    await init_workflows()  # 在應用啟動時編譯工作流程並設置 checkpointer
+    await checkpoint_pruner.setup()  # 在應用啟動時開始定期刪除過期的 checkpoint
+    if SEMANTIC_CACHE_ENABLED:
+        await semantic_cache.setup(get_index_version())
+    if FAST_ROUTER_ENABLED:
+        await fast_router.setup()  # 在應用啟動時計算快速路由的主題中心點
     yield
+    if FAST_ROUTER_ENABLED:
+        fast_router.report()
+    if MODERATION_ENABLED:
+        pre_moderator.report()
+    cassette = get_cassette()
+    if cassette:
+        cassette.report()
+        cassette.close()
+    await checkpoint_pruner.close()
+    await semantic_cache.close()
+    for workflow in _workflows.values():
+        if isinstance(workflow.checkpointer, WriteBehindSaver):
+            await workflow.checkpointer.close()  # 寫入記憶體中剩餘的 checkpoint
+    _workflows.clear()
+    await history.close()  # 寫入佇列中剩餘的對話歷史
+    await close_llm_clients()
     if _pool is not None:
-        _pool.close()
+        await _pool.close()
         _pool = None
 
 app = FastAPI(title="機車交通法規問答系統", lifespan=lifespan)
@@ -91,6 +156,8 @@ app.add_middleware(
 
 class Question(BaseModel):
     text: str
+    # 前端產生並保存的 session 識別碼，對話歷史依此區分
+    session_id: str = Field(DEFAULT_SESSION, max_length=128)
 
 
 class Answer(BaseModel):
@@ -108,63 +175,60 @@ class ConversationHistory(BaseModel):
 async def get_answer(question: Question):
     """處理問答請求"""
     try:
-        answer = run_query(question.text)
+        answer = await run_query(question.text, question.session_id)
         return Answer(response=answer)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/query/stream")
+async def stream_answer(question: Question):
+    """以 Server-Sent Events 串流問答進度與回答"""
+    return StreamingResponse(
+        stream_query(question.text, question.session_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    """以 Prometheus 格式輸出監控指標"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/history", response_model=List[ConversationHistory])
-async def get_history():
-    """獲取對話歷史"""
+async def get_history(session_id: str = Query(DEFAULT_SESSION, max_length=128)):
+    """獲取 session 的對話歷史"""
     try:
-        pool = get_connection_pool()
-        with pool.connection() as conn:
-            with conn.cursor() as cur:
-                # 添加日誌
-                print("正在查詢對話歷史...")
-                cur.execute("""
-                    SELECT conversation_id, 
-                           state->>'question' as question,
-                           state->>'generation' as answer,
-                           created_at
-                    FROM conversation_history
-                    ORDER BY created_at DESC
-                    LIMIT 10
-                """)
-                rows = cur.fetchall()
-                print(f"查詢結果: {rows}")  # 添加日誌
-
-                return [
-                    ConversationHistory(
-                        conversation_id=row[0],
-                        question=row[1],
-                        answer=row[2],
-                        created_at=row[3]
-                    )
-                    for row in rows
-                ]
+        rows = await history.list(session_id)
+        logger.debug("查詢對話歷史完成", extra={"session_id": session_id, "rows": len(rows)})
+        return [ConversationHistory(**row) for row in rows]
     except Exception as e:
-        print(f"獲取歷史記錄時發生錯誤: {str(e)}")  # 添加錯誤日誌
+        logger.exception(f"獲取歷史記錄時發生錯誤: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def create_workflow():
+async def create_workflow(checkpointer=None):
     """創建工作流程圖"""
     workflow = StateGraph(GraphState)
 
-    # 添加節點
-    workflow.add_node("web_search", web_search)
-    workflow.add_node("retrieve", retrieve)
-    workflow.add_node("retrieval_grade", retrieval_grade)
-    workflow.add_node("rag_generate", rag_generate)
-    workflow.add_node("plain_answer", plain_answer)
-    workflow.add_node("update_web_search", update_web_search)
-    workflow.add_node("update_rag_generate", update_rag_generate)
+    # 添加節點，每個節點與路由都記錄執行時間
+    nodes = {
+        "web_search": web_search,
+        "retrieve": retrieve,
+        "retrieval_grade": retrieval_grade,
+        "rag_generate": rag_generate,
+        "plain_answer": plain_answer,
+        "update_web_search": update_web_search,
+        "update_rag_generate": update_rag_generate,
+    }
+    for name, node in nodes.items():
+        workflow.add_node(name, instrument_node(name, node))
 
     # 設置條件入口
     workflow.set_conditional_entry_point(
-        route_question,
+        instrument_router("route_question", route_question),
         {
             "web_search": "web_search",
             "vectorstore": "retrieve",
@@ -181,7 +245,7 @@ def create_workflow():
 
     workflow.add_conditional_edges(
         "retrieval_grade",
-        route_retrieval,
+        instrument_router("route_retrieval", route_retrieval),
         {
             "web_search": "update_web_search",
             "rag_generate": "rag_generate",
@@ -191,7 +255,7 @@ def create_workflow():
 
     workflow.add_conditional_edges(
         "rag_generate",
-        grade_rag_generation,
+        instrument_router("grade_rag_generation", grade_rag_generation),
         {
             "not supported": "update_rag_generate",
             "not useful": "update_web_search",
@@ -202,77 +266,184 @@ def create_workflow():
 
     workflow.add_edge("plain_answer", END)
 
-    postgres_saver = create_postgres_saver()
+    if checkpointer is None:
+        checkpointer = await create_checkpointer()
 
-    return workflow.compile(checkpointer=postgres_saver)
+    return workflow.compile(checkpointer=checkpointer)
 
 
-def run_query(question: str):
-    """執行查詢"""
-    app = create_workflow()
-    conversation_id = str(datetime.now().timestamp())
+async def init_workflows():
+    """編譯工作流程並註冊，checkpointer 僅在此設置一次"""
+    if "default" not in _workflows:
+        _workflows["default"] = await create_workflow()
+    return _workflows
+
+
+async def get_workflow(name: str = "default"):
+    """取得已編譯的工作流程，尚未初始化時建立"""
+    if name not in _workflows:
+        await init_workflows()
+    return _workflows[name]
+
+
+# 內容審核未通過或流程沒有產生答案時的回覆
+NO_ANSWER = "抱歉，無法處理您的問題"
+
+
+def create_run(question: str):
+    """建立一次查詢的輸入與設定"""
+    conversation_id = uuid.uuid4().hex
 
     inputs = {
         "question": question,
+        "conversation_id": conversation_id,
         "web_search_retry_count": 0,
         "rag_generate_retry_count": 0
     }
     config = {
+        # 每次對話使用獨立的 thread，checkpoint 可依對話清除
         "configurable": {
-            "thread_id": "default",
+            "thread_id": conversation_id,
             "checkpoint_ns": "conversation",
-            "checkpoint_id": conversation_id
-        }
+            # 本次查詢的推測檢索，查詢結束時捨棄未使用的檢索
+            SPECULATIVE_KEY: SpeculativeRetrieval()
+        },
+        # 記錄每次 LLM 呼叫的時間與 token 數
+        "callbacks": [metrics_callback]
     }
+    return conversation_id, inputs, config
+
+
+async def save_history(conversation_id: str, question: str, answer: str,
+                       session_id: str = DEFAULT_SESSION):
+    """保存對話歷史，排入背景批次寫入，不等待資料庫"""
+    logger.debug("排入對話歷史", extra={"conversation_id": conversation_id, "session_id": session_id})
+    history.add(session_id, conversation_id, question, answer)
+
+
+async def run_query(question: str, session_id: str = DEFAULT_SESSION):
+    """執行查詢"""
+    app = await get_workflow()
+    conversation_id, inputs, config = create_run(question)
+
+    cached, embedding = await lookup_cache(question)
+    if cached is NO_ANSWER:
+        return cached
+    if cached is not None:
+        await save_history(conversation_id, question, cached, session_id)
+        return cached
 
     output = None
-    for output in app.stream(inputs, config=config):
-        print("\n")
+    try:
+        async for output in app.astream(inputs, config=config, durability=CHECKPOINT_DURABILITY):
+            pass
+    finally:
+        config["configurable"][SPECULATIVE_KEY].discard()
 
     if output is None:
-        return "抱歉，無法處理您的問題"
+        return NO_ANSWER
+
+    answer = ""
+    if "rag_generate" in output:
+        answer = output["rag_generate"]["generation"]
+        await store_cache(question, embedding, answer)
+    elif "plain_answer" in output:
+        answer = output["plain_answer"]["generation"]
+
+    await save_history(conversation_id, question, answer, session_id)
+    return answer
 
-    # 保存對話歷史
+
+async def lookup_cache(question: str):
+    """查詢語意快取，快取停用或失敗時視為未命中"""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None, None
+    try:
+        cached, embedding = await semantic_cache.lookup(question)
+    except Exception as e:
+        logger.exception(f"查詢語意快取時發生錯誤: {str(e)}")
+        return None, None
+    # 快取命中略過了流程中的內容審核，與快取問題相似的不當問題也須拒答
+    if cached is not None and await grade_question(question) == "yes":
+        logger.info("cached answer blocked by moderation")
+        # 與流程中審核未通過相同，不保存對話歷史
+        return NO_ANSWER, None
+    return cached, embedding
+
+
+async def store_cache(question: str, embedding, answer: str):
+    """保存通過評估的 RAG 答案至語意快取"""
+    if not SEMANTIC_CACHE_ENABLED or embedding is None or not answer:
+        return
     try:
-        answer = ""
-        if "rag_generate" in output:
-            answer = output["rag_generate"]["generation"]
-        elif "plain_answer" in output:
-            answer = output["plain_answer"]["generation"]
-
-        print(f"準備保存對話歷史: ID={conversation_id}, Q={question}, A={answer}")
-
-        pool = get_connection_pool()
-        with pool.connection() as conn:
-            with conn.cursor() as cur:
-                # 先刪除多餘的舊記錄，只保留最新的兩條（加上即將插入的新記錄，共三條）
-                cur.execute("""
-                    DELETE FROM conversation_history 
-                    WHERE conversation_id NOT IN (
-                        SELECT conversation_id 
-                        FROM conversation_history 
-                        ORDER BY created_at DESC 
-                        LIMIT 2
-                    )
-                """)
-
-                # 插入新記錄
-                state = json.dumps({
-                    "question": question,
-                    "generation": answer
-                })
-                cur.execute("""
-                    INSERT INTO conversation_history (conversation_id, state, created_at)
-                    VALUES (%s, %s::jsonb, %s)
-                """, (conversation_id, state, datetime.now()))
-
-                conn.commit()
-                print("對話歷史保存成功")
+        await semantic_cache.store(question, embedding, answer)
     except Exception as e:
-        print(f"保存對話歷史時發生錯誤: {str(e)}")
-        print(f"錯誤詳情: question={question}, answer={answer}")
+        logger.exception(f"保存語意快取時發生錯誤: {str(e)}")
 
-    return answer
+
+def format_sse(payload: dict):
+    """格式化 Server-Sent Events 訊息"""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def stream_query(question: str, session_id: str = DEFAULT_SESSION):
+    """執行查詢並以 Server-Sent Events 串流節點進度與生成 token"""
+    app = await get_workflow()
+    conversation_id, inputs, config = create_run(question)
+
+    cached, embedding = await lookup_cache(question)
+    if cached is NO_ANSWER:
+        yield format_sse({"type": "final", "answer": cached})
+        return
+    if cached is not None:
+        yield format_sse({"type": "final", "answer": cached, "cached": True})
+        await save_history(conversation_id, question, cached, session_id)
+        return
+
+    answer = None
+    answer_node = None
+    try:
+        async for event in app.astream_events(
+                inputs, config=config, version="v2", durability=CHECKPOINT_DURABILITY):
+            kind = event["event"]
+            name = event["name"]
+            node = event.get("metadata", {}).get("langgraph_node")
+
+            if kind == "on_chain_start" and name == node and name in STREAM_NODES:
+                # 生成節點重新開始時（重試），前端應清除目前的草稿
+                yield format_sse({"type": "node", "node": name})
+            elif kind == "on_chain_end" and name in STREAM_ROUTERS:
+                yield format_sse({
+                    "type": "route", "router": name, "decision": event["data"].get("output")})
+            elif kind == "on_chat_model_stream" and ANSWER_STREAM_TAG in event.get("tags", []):
+                content = event["data"]["chunk"].content
+                if content:
+                    yield format_sse({"type": "token", "node": node, "content": content})
+            elif kind == "on_chain_end" and name == node and name in GENERATION_NODES:
+                answer = event["data"]["output"]["generation"]
+                answer_node = name
+    except Exception as e:
+        logger.exception(f"串流查詢時發生錯誤: {str(e)}")
+        yield format_sse({"type": "error", "detail": str(e)})
+        return
+    finally:
+        config["configurable"][SPECULATIVE_KEY].discard()
+
+    if answer is None:
+        yield format_sse({"type": "final", "answer": NO_ANSWER})
+        return
+
+    # 生成內容通過評估（或被 plain_answer 取代）後才送出最終答案
+    yield format_sse({"type": "final", "answer": answer})
+    if answer_node == "rag_generate":
+        await store_cache(question, embedding, answer)
+    await save_history(conversation_id, question, answer, session_id)
+
+
+async def run_query_with_timeout(question: str, timeout: float = 120,
+                                 session_id: str = DEFAULT_SESSION):
+    """執行查詢並限制最長等待時間"""
+    return await asyncio.wait_for(run_query(question, session_id), timeout=timeout)
 
 
 # 修改啟動方式
@@ -0,0 +1,175 @@
+"""量測各 checkpoint 模式下每個問題的資料庫寫入次數與延遲
+
+用法:
+    python benchmarks/bench_checkpoints.py [--modes sync,async,exit,memory] [--requests 64]
+        [--concurrency 8] [--path vectorstore] [--db-latency 0.002] [--db-uri postgresql://...]
+
+模式:
+    sync    每一步完成寫入後才繼續（durability=sync）
+    async   寫入與下一步並行（durability=async，預設）
+    exit    只在流程結束時寫入（durability=exit）
+    memory  記憶體 checkpointer，背景將每個對話最新的 checkpoint 寫入資料庫
+
+LLM、embedding 與搜尋使用 benchmarks/fakes.py 的替身。未指定 --db-uri 時資料庫以記憶體 checkpointer
+加上每次往返 --db-latency 秒模擬；指定時寫入實際的 Postgres。
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 必須在匯入 config 之前設定
+TMP_DIR = tempfile.mkdtemp(prefix="bench-checkpoints-")
+os.makedirs(os.path.join(TMP_DIR, "sources"))
+shutil.copyfile(os.path.join(ROOT, "motorcycle_safety_02.pdf"),
+                os.path.join(TMP_DIR, "sources", "motorcycle_safety_02.pdf"))
+os.environ.update({
+    "OPENAI_API_KEY": "bench", "GOOGLE_API_KEY": "bench", "TAVILY_API_KEY": "bench",
+    "SOURCE_DIR": os.path.join(TMP_DIR, "sources"),
+    "VECTOR_STORE_DIR": os.path.join(TMP_DIR, "vector_store"),
+    "VECTOR_BACKEND": "numpy",
+    "EMBEDDING_CACHE_ENABLED": "false",
+    "SEMANTIC_CACHE_ENABLED": "false",
+    "WEB_SEARCH_CACHE_TTL": "0",
+    "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+})
+
+import numpy as np  # noqa: E402
+from langgraph.checkpoint.base import BaseCheckpointSaver  # noqa: E402
+from fakes import Latency, Scenario, install_fakes  # noqa: E402
+
+MODES = ("sync", "async", "exit", "memory")
+
+
+class CountingSaver(BaseCheckpointSaver):
+    """轉呼叫實際 checkpointer，計算每種資料庫操作的次數並模擬往返延遲"""
+
+    def __init__(self, inner, latency=0.0):
+        super().__init__(serde=inner.serde)
+        self.inner = inner
+        self.latency = latency
+        self.counts = Counter()
+
+    async def _round_trip(self, kind):
+        self.counts[kind] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def get_next_version(self, current, channel):
+        return self.inner.get_next_version(current, channel)
+
+    async def aget_tuple(self, config):
+        await self._round_trip("reads")
+        return await self.inner.aget_tuple(config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        await self._round_trip("reads")
+        async for item in self.inner.alist(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        await self._round_trip("checkpoints")
+        return await self.inner.aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        await self._round_trip("writes")
+        return await self.inner.aput_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        await self._round_trip("deletes")
+        return await self.inner.adelete_thread(thread_id)
+
+
+async def create_database(db_uri):
+    """建立模擬或實際的資料庫 checkpointer，回傳 (checkpointer, 關閉函式)"""
+    if not db_uri:
+        from langgraph.checkpoint.memory import InMemorySaver
+        return InMemorySaver(), None
+    from psycopg_pool import AsyncConnectionPool
+    from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+    pool = AsyncConnectionPool(
+        conninfo=db_uri, max_size=20, open=False,
+        kwargs={"autocommit": True, "prepare_threshold": 0})
+    await pool.open()
+    saver = AsyncPostgresSaver(pool)
+    await saver.setup()
+    return saver, pool.close
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--path", default="vectorstore")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--db-latency", type=float, default=0.002, help="未指定 --db-uri 時每次往返的模擬延遲")
+    parser.add_argument("--db-uri")
+    args = parser.parse_args()
+
+    scenario = Scenario(args.path)
+    install_fakes(Latency(args.llm_latency, 0.3, 0), Latency(0.02, 0.3, 1),
+                  Latency(0.1, 0.3, 2), scenario)
+
+    import app
+    from data.data import init_retriever
+    from services.checkpoints import WriteBehindSaver
+
+    async def no_history(*args, **kwargs):
+        return None
+
+    app.save_history = no_history
+    await asyncio.to_thread(init_retriever)
+
+    print(f"{'mode':<8} {'p50':>9} {'p95':>9} {'req/s':>7} {'checkpoints/q':>14} "
+          f"{'writes/q':>9} {'reads/q':>8}")
+    offset = 0
+    for mode in args.modes.split(","):
+        database, close = await create_database(args.db_uri)
+        counting = CountingSaver(database, args.db_latency if not args.db_uri else 0.0)
+        checkpointer = counting
+        if mode == "memory":
+            checkpointer = WriteBehindSaver(counting, flush_interval=1.0)
+        app.CHECKPOINT_DURABILITY = "async" if mode == "memory" else mode
+        app._workflows["default"] = await app.create_workflow(checkpointer=checkpointer)
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+
+        async def one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                await app.run_query(f"大型重型機車可以行駛高速公路嗎？ #{i}")
+                latencies.append(time.perf_counter() - start)
+
+        scenario.reset(args.path)
+        start = time.perf_counter()
+        await asyncio.gather(*(one(offset + i) for i in range(args.requests)))
+        wall = time.perf_counter() - start
+        offset += args.requests
+
+        # memory 模式的資料庫操作在背景進行，結束時寫入剩餘的 checkpoint 後一併計算
+        if isinstance(checkpointer, WriteBehindSaver):
+            await checkpointer.close()
+        if close:
+            await close()
+
+        n = args.requests
+        counts = counting.counts
+        p50, p95 = (x * 1000 for x in np.percentile(latencies, [50, 95]))
+        print(f"{mode:<8} {p50:>7.1f}ms {p95:>7.1f}ms {n / wall:>7.1f} "
+              f"{counts['checkpoints'] / n:>14.2f} {counts['writes'] / n:>9.2f} {counts['reads'] / n:>8.2f}")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    finally:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
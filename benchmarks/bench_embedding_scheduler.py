@@ -0,0 +1,149 @@
+"""量測 embedding 排程器在不同批次大小與並行數下的吞吐量（區塊/秒）
+
+用法:
+    python benchmarks/bench_embedding_scheduler.py [--texts 2000] [--batch-sizes 50,100]
+        [--concurrency 1,2,4,8] [--latency 0.2] [--per-item 0.002] [--limit 6]
+
+以本地替身模型模擬遠端 API：每次請求固定延遲加上每筆區塊的延遲，
+同時進行中的請求超過 --limit 時回傳 429，用以觀察退避重試的成本。不呼叫任何外部服務。
+量測前先確認同步呼叫不會在其他事件迴圈上使用底層模型的非同步連線。
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from langchain_core.embeddings import Embeddings  # noqa: E402
+from services.embedding_scheduler import EmbeddingScheduler  # noqa: E402
+
+
+class RateLimitError(Exception):
+    """模擬 429 Too Many Requests"""
+
+    status_code = 429
+
+
+class FakeEmbeddings(Embeddings):
+    """具延遲與並行上限的 embedding 替身"""
+
+    def __init__(self, latency, per_item, limit, dimension=8):
+        self.latency = latency
+        self.per_item = per_item
+        self.limit = limit
+        self.dimension = dimension
+        self.in_flight = 0
+        self.requests = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def _enter(self):
+        with self.lock:
+            self.requests += 1
+            if self.limit and self.in_flight >= self.limit:
+                self.rejected += 1
+                raise RateLimitError("429 Too Many Requests")
+            self.in_flight += 1
+
+    def _exit(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def _vectors(self, texts):
+        return [[float(len(text))] * self.dimension for text in texts]
+
+    async def aembed_documents(self, texts):
+        self._enter()
+        try:
+            await asyncio.sleep(self.latency + self.per_item * len(texts))
+        finally:
+            self._exit()
+        return self._vectors(texts)
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+    def embed_documents(self, texts):
+        self._enter()
+        try:
+            time.sleep(self.latency + self.per_item * len(texts))
+        finally:
+            self._exit()
+        return self._vectors(texts)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class LoopBoundEmbeddings(FakeEmbeddings):
+    """非同步方法綁定第一次使用的事件迴圈，模擬共用連線池的 HTTP 用戶端"""
+
+    def __init__(self):
+        super().__init__(0.0, 0.0, 0)
+        self.loop = None
+
+    async def aembed_documents(self, texts):
+        loop = asyncio.get_running_loop()
+        if self.loop is None:
+            self.loop = loop
+        if self.loop is not loop or self.loop.is_closed():
+            raise RuntimeError("Event loop is closed")
+        return await super().aembed_documents(texts)
+
+
+def check_loop_affinity():
+    """重複同步呼叫並與事件迴圈上的非同步呼叫交錯，不可在其他事件迴圈上使用底層模型"""
+    scheduler = EmbeddingScheduler(LoopBoundEmbeddings(), batch_size=2, max_concurrency=2)
+
+    async def on_loop():
+        await scheduler.aembed_query("q")
+        # 事件迴圈中的同步呼叫（例如 run_in_executor 中的 embed_query）
+        await asyncio.to_thread(scheduler.embed_query, "q")
+        await asyncio.to_thread(scheduler.embed_documents, ["a", "b", "c"])
+        await scheduler.aembed_documents(["a", "b", "c"])
+
+    for _ in range(3):
+        scheduler.embed_query("q")
+        scheduler.embed_documents(["a", "b", "c"])
+    asyncio.run(on_loop())
+    for _ in range(3):
+        scheduler.embed_query("q")
+    print("loop affinity check: ok")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--batch-sizes", default="50,100")
+    parser.add_argument("--concurrency", default="1,2,4,8")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--per-item", type=float, default=0.002)
+    parser.add_argument("--limit", type=int, default=6)
+    args = parser.parse_args()
+
+    check_loop_affinity()
+    texts = [f"區塊 {i} " * 20 for i in range(args.texts)]
+    print(f"{'batch':>6} {'conc':>5} {'requests':>9} {'429s':>6} {'seconds':>8} {'texts/s':>9} {'speedup':>8}")
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        baseline = None
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            fake = FakeEmbeddings(args.latency, args.per_item, args.limit)
+            scheduler = EmbeddingScheduler(
+                fake, batch_size=batch_size, max_concurrency=concurrency,
+                backoff_base=0.1, backoff_max=1.0)
+            start = time.perf_counter()
+            vectors = scheduler.embed_documents(texts)
+            seconds = time.perf_counter() - start
+            assert len(vectors) == len(texts)
+            rate = len(texts) / seconds
+            baseline = baseline or rate
+            print(f"{batch_size:>6} {concurrency:>5} {fake.requests:>9} {fake.rejected:>6} "
+                  f"{seconds:>8.2f} {rate:>9.1f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
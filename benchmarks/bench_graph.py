@@ -0,0 +1,186 @@
+"""以本地替身離線量測整個問答流程的延遲、吞吐量與記憶體
+
+用法:
+    python benchmarks/bench_graph.py [--paths vectorstore,web_retry] [--concurrency 1,4,16,64]
+        [--requests 64] [--targets run_query,http] [--llm-latency 0.05] [--llm-sigma 0.3]
+        [--embed-latency 0.02] [--search-latency 0.1] [--json results.json]
+
+OpenAI、Google embedding、Tavily 與 Postgres checkpointer 皆以可重現的本地替身取代，
+向量索引以替身 embedding 對專案內的 PDF 建立。每條圖路徑分別量測：
+    vectorstore          檢索後直接生成並通過評估
+    web_retry            檢索文件皆不相關，改用網路搜尋後生成
+    hallucination_retry  第一次生成被判定為幻覺，重新生成
+    plain_answer         路由未選擇工具，直接以 LLM 回答
+    blocked              內容審核未通過
+targets 中 run_query 直接呼叫 app.run_query，http 經由 FastAPI 的 POST /query。
+將各項延遲設為 0 可量測流程本身（LangGraph、檢索、評分解析）的開銷。
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 必須在匯入 config 之前設定
+TMP_DIR = tempfile.mkdtemp(prefix="bench-graph-")
+os.makedirs(os.path.join(TMP_DIR, "sources"))
+shutil.copyfile(os.path.join(ROOT, "motorcycle_safety_02.pdf"),
+                os.path.join(TMP_DIR, "sources", "motorcycle_safety_02.pdf"))
+os.environ.update({
+    "OPENAI_API_KEY": "bench", "GOOGLE_API_KEY": "bench", "TAVILY_API_KEY": "bench",
+    "SOURCE_DIR": os.path.join(TMP_DIR, "sources"),
+    "VECTOR_STORE_DIR": os.path.join(TMP_DIR, "vector_store"),
+    "VECTOR_BACKEND": "numpy",
+    "EMBEDDING_CACHE_ENABLED": "false",
+    "SEMANTIC_CACHE_ENABLED": "false",
+    "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+})
+
+import numpy as np  # noqa: E402
+from fakes import PATHS, Latency, Scenario, install_fakes  # noqa: E402
+
+
+class SampleRecorder:
+    """取代 Prometheus 直方圖，保留每個節點的原始耗時以計算百分位數"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def labels(self, name):
+        recorder = self
+
+        class Observer:
+            def observe(self, value):
+                recorder.samples[name].append(value)
+        return Observer()
+
+
+def percentiles(samples):
+    """回傳 p50、p95、p99（毫秒）"""
+    if not samples:
+        return [0.0, 0.0, 0.0]
+    return [float(x) * 1000 for x in np.percentile(samples, [50, 95, 99])]
+
+
+def rss_mb():
+    """目前常駐記憶體（MB）"""
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+async def run_batch(call, requests, concurrency, offset):
+    """以固定並行數送出 requests 個請求，回傳每個請求耗時與總耗時"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await call(f"大型重型機車可以行駛高速公路嗎？ #{offset + i}")
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies, time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--paths", default=",".join(PATHS))
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--targets", default="run_query,http")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--llm-sigma", type=float, default=0.3)
+    parser.add_argument("--embed-latency", type=float, default=0.02)
+    parser.add_argument("--search-latency", type=float, default=0.1)
+    parser.add_argument("--answer-chars", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--web-cache", action="store_true", help="保留網路搜尋快取（預設每次都呼叫替身）")
+    parser.add_argument("--json")
+    args = parser.parse_args()
+
+    if not args.web_cache:
+        os.environ["WEB_SEARCH_CACHE_TTL"] = "0"
+
+    scenario = Scenario()
+    install_fakes(
+        Latency(args.llm_latency, args.llm_sigma, args.seed),
+        Latency(args.embed_latency, args.llm_sigma, args.seed + 1),
+        Latency(args.search_latency, args.llm_sigma, args.seed + 2),
+        scenario, args.answer_chars)
+
+    import app
+    import httpx
+    import services.metrics
+    from data.data import init_retriever
+    from langgraph.checkpoint.memory import MemorySaver
+
+    async def no_history(*args, **kwargs):
+        return None
+
+    # 以記憶體 checkpointer 取代 Postgres，不保存對話歷史
+    app.save_history = no_history
+    await asyncio.to_thread(init_retriever)
+    app._workflows["default"] = await app.create_workflow(checkpointer=MemorySaver())
+
+    recorder = SampleRecorder()
+    services.metrics.NODE_LATENCY = recorder
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app.app), base_url="http://bench")
+
+    async def call_http(question):
+        response = await client.post("/query", json={"text": question})
+        response.raise_for_status()
+
+    targets = {"run_query": app.run_query, "http": call_http}
+
+    results = []
+    offset = 0
+    print(f"{'path':<20} {'target':<10} {'conc':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'rss MB':>8}")
+    for path in args.paths.split(","):
+        node_samples = defaultdict(list)
+        for target in args.targets.split(","):
+            for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                scenario.reset(path)
+                recorder.samples.clear()
+                latencies, wall = await run_batch(targets[target], args.requests, concurrency, offset)
+                offset += args.requests
+                p50, p95, p99 = percentiles(latencies)
+                row = {
+                    "path": path, "target": target, "concurrency": concurrency,
+                    "throughput": args.requests / wall, "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+                    "rss_mb": rss_mb(),
+                    "nodes": {name: percentiles(s) for name, s in recorder.samples.items()},
+                }
+                results.append(row)
+                for name, samples in recorder.samples.items():
+                    node_samples[name].extend(samples)
+                print(f"{path:<20} {target:<10} {concurrency:>5} {row['throughput']:>8.1f} "
+                      f"{p50:>7.1f}ms {p95:>7.1f}ms {p99:>7.1f}ms {row['rss_mb']:>8.1f}")
+
+        print(f"  per-node latency for {path} (all targets and concurrency levels):")
+        for name, samples in sorted(node_samples.items()):
+            p50, p95, p99 = percentiles(samples)
+            print(f"    {name:<22} n={len(samples):>5} p50={p50:7.1f}ms p95={p95:7.1f}ms p99={p99:7.1f}ms")
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"peak rss: {peak:.1f} MB")
+    await client.aclose()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"args": vars(args), "peak_rss_mb": peak, "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    finally:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
@@ -0,0 +1,74 @@
+"""量測 PDF 解析與切分在不同子行程數下的吞吐量（頁/秒）
+
+用法:
+    python benchmarks/bench_ingest_parallel.py [--copies 32] [--workers 1,2,4,8]
+    python benchmarks/bench_ingest_parallel.py --source-dir path/to/pdfs
+
+未指定 --source-dir 時複製專案內的 motorcycle_safety_02.pdf 作為語料。
+只量測解析與切分，向量資料庫以不做任何事的替身取代，不呼叫 embedding API。
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from data.ingest import update_index  # noqa: E402
+from services.embeddings import create_text_splitter  # noqa: E402
+
+
+class NullVectorStore:
+    """丟棄所有區塊的向量資料庫替身"""
+
+    def add_documents(self, documents, ids=None):
+        return ids
+
+    def delete(self, ids=None):
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source-dir")
+    parser.add_argument("--copies", type=int, default=32)
+    parser.add_argument("--workers", default="1,2,4,8")
+    args = parser.parse_args()
+
+    tmp_dir = None
+    if args.source_dir:
+        sources = sorted(glob.glob(os.path.join(args.source_dir, "**", "*.pdf"), recursive=True))
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix="bench-ingest-")
+        sample = os.path.join(ROOT, "motorcycle_safety_02.pdf")
+        sources = []
+        for i in range(args.copies):
+            path = os.path.join(tmp_dir, f"doc_{i:04d}.pdf")
+            shutil.copyfile(sample, path)
+            sources.append(path)
+
+    try:
+        print(f"{'workers':>7} {'files':>6} {'pages':>7} {'chunks':>7} {'seconds':>8} {'pages/s':>9} {'speedup':>8}")
+        baseline = None
+        for workers in [int(w) for w in args.workers.split(",")]:
+            manifest = {"files": {}}
+            start = time.perf_counter()
+            added, _, _ = update_index(
+                NullVectorStore(), manifest, sources, create_text_splitter(), workers=workers)
+            seconds = time.perf_counter() - start
+            pages = sum(len(entry["pages"]) for entry in manifest["files"].values())
+            rate = pages / seconds
+            baseline = baseline or rate
+            print(f"{workers:>7} {len(sources):>6} {pages:>7} {len(added):>7} "
+                  f"{seconds:>8.2f} {rate:>9.1f} {rate / baseline:>7.2f}x")
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
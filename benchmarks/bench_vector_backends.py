@@ -0,0 +1,139 @@
+"""比較 Chroma 與 NumPy 記憶體映射向量後端的建立時間、查詢延遲與記憶體用量
+
+用法:
+    python benchmarks/bench_vector_backends.py [--sizes 1000,100000,1000000] [--dim 768]
+
+每個 (後端, 資料量) 組合在獨立子行程中執行，以便分別量測 RSS。
+向量為隨機產生的單位向量，不呼叫任何 embedding API；與 data/ingest.py 相同，每批加入 INGEST_BATCH_SIZE 個區塊。
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from data.ingest import INGEST_BATCH_SIZE  # noqa: E402
+
+
+def current_rss_mb():
+    """目前行程常駐記憶體（MB）"""
+    with open("/proc/self/statm") as file:
+        pages = int(file.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def peak_rss_mb():
+    """行程峰值常駐記憶體（MB）"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def random_vectors(rng, n, dim):
+    vectors = rng.standard_normal((n, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build_numpy(directory, size, dim, rng):
+    from services.numpy_store import NumpyVectorStore
+
+    store = NumpyVectorStore(None, persist_directory=directory)
+    for start in range(0, size, INGEST_BATCH_SIZE):
+        n = min(INGEST_BATCH_SIZE, size - start)
+        store.add_embeddings(
+            [f"chunk {start + i}" for i in range(n)], random_vectors(rng, n, dim),
+            ids=[str(start + i) for i in range(n)])
+    del store
+    # 以記憶體映射重新開啟，模擬啟動時載入
+    return NumpyVectorStore(None, persist_directory=directory)
+
+
+def build_chroma(directory, size, dim, rng):
+    from langchain_chroma import Chroma
+
+    store = Chroma(collection_name="bench", persist_directory=directory,
+                   collection_metadata={"hnsw:space": "cosine"})
+    for start in range(0, size, INGEST_BATCH_SIZE):
+        n = min(INGEST_BATCH_SIZE, size - start)
+        store._collection.add(
+            ids=[str(start + i) for i in range(n)],
+            embeddings=random_vectors(rng, n, dim),
+            documents=[f"chunk {start + i}" for i in range(n)])
+    return store
+
+
+def run_worker(backend, size, dim, queries, k):
+    """在子行程中建立索引並量測"""
+    rng = np.random.default_rng(0)
+    directory = tempfile.mkdtemp(prefix=f"bench-{backend}-")
+    try:
+        baseline = current_rss_mb()
+        start = time.perf_counter()
+        build = build_numpy if backend == "numpy" else build_chroma
+        store = build(directory, size, dim, rng)
+        build_seconds = time.perf_counter() - start
+
+        query_vectors = random_vectors(rng, queries, dim)
+        latencies = []
+        for vector in query_vectors:
+            start = time.perf_counter()
+            store.similarity_search_by_vector(vector.tolist(), k=k)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        result = {
+            "backend": backend,
+            "size": size,
+            "build_s": build_seconds,
+            "query_p50_ms": statistics.median(latencies),
+            "query_p95_ms": float(np.percentile(latencies, 95)),
+            "rss_mb": current_rss_mb() - baseline,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        if backend == "numpy":
+            start = time.perf_counter()
+            store.batch_search_by_vectors(query_vectors, k=k)
+            result["batch_query_ms_per_q"] = (time.perf_counter() - start) * 1000 / queries
+        print(json.dumps(result))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--backends", default="numpy,chroma")
+    parser.add_argument("--worker", nargs=2, metavar=("BACKEND", "SIZE"))
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker[0], int(args.worker[1]), args.dim, args.queries, args.k)
+        return
+
+    print(f"{'backend':<8} {'size':>9} {'build':>9} {'q p50':>9} {'q p95':>9} "
+          f"{'batch/q':>9} {'RSS':>9} {'peak RSS':>9}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        for backend in args.backends.split(","):
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", backend, str(size),
+                 "--dim", str(args.dim), "--queries", str(args.queries), "--k", str(args.k)],
+                capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"{backend:<8} {size:>9} failed: {proc.stderr.strip().splitlines()[-1]}")
+                continue
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            batch = f"{r['batch_query_ms_per_q']:8.3f}ms" if "batch_query_ms_per_q" in r else f"{'-':>10}"
+            print(f"{backend:<8} {size:>9} {r['build_s']:8.2f}s {r['query_p50_ms']:7.3f}ms "
+                  f"{r['query_p95_ms']:7.3f}ms {batch} {r['rss_mb']:7.1f}MB {r['peak_rss_mb']:7.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""比較每次請求重新編譯工作流程與啟動時編譯一次的延遲
+
+用法:
+    python benchmarks/bench_workflow_startup.py [--runs 20]
+
+設定 DB_URI 時使用 PostgresSaver（包含 setup() 的資料表遷移），
+否則以記憶體 checkpointer 僅量測圖的建立與編譯成本。
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from config.config import DB_URI  # noqa: E402
+from langgraph.checkpoint.memory import MemorySaver  # noqa: E402
+
+
+async def timed(func, runs):
+    """執行多次並回傳每次耗時（毫秒）"""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summary(name, samples):
+    print(f"{name:<28} mean={statistics.mean(samples):8.2f}ms "
+          f"p50={statistics.median(samples):8.2f}ms max={max(samples):8.2f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    if DB_URI:
+        print("checkpointer: PostgresSaver")
+
+        async def per_request():
+            return await app.create_workflow()
+    else:
+        print("checkpointer: MemorySaver（未設定 DB_URI，不含 setup() 成本）")
+
+        async def per_request():
+            return await app.create_workflow(checkpointer=MemorySaver())
+
+    async def startup():
+        app._workflows["default"] = await per_request()
+
+    summary("startup (once)", await timed(startup, 1))
+
+    rebuild = await timed(per_request, args.runs)
+    cached = await timed(app.get_workflow, args.runs)
+    summary("per request: rebuild", rebuild)
+    summary("per request: registry", cached)
+    print(f"saved per query: {statistics.mean(rebuild) - statistics.mean(cached):.2f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
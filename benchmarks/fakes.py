@@ -0,0 +1,219 @@
+"""離線基準測試使用的替身：LLM、embedding、Tavily 搜尋，延遲依對數常態分布抽樣且可重現
+
+install_fakes() 必須在匯入 app 之前呼叫，因為評分與生成 chain 於匯入時建立。
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from typing import Any
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+# 網路搜尋替身回傳的內容帶有此標記，供檢索評分替身區分來源
+WEB_MARKER = "[web]"
+# 基準測試為每個問題加上的請求編號，例如「... #17」
+REQUEST_TAG = re.compile(r"#(\d+)")
+
+# 各圖路徑對應的評分結果
+PATHS = ("vectorstore", "web_retry", "hallucination_retry", "plain_answer", "blocked")
+
+
+class Latency:
+    """以中位數與對數標準差描述的對數常態延遲，固定種子可重現"""
+
+    def __init__(self, median: float, sigma: float = 0.0, seed: int = 0):
+        self.median = median
+        self.sigma = sigma
+        self.random = random.Random(seed)
+
+    def sample(self):
+        if self.median <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return self.median
+        return self.random.lognormvariate(np.log(self.median), self.sigma)
+
+
+class Scenario:
+    """目前要走的圖路徑，以及幻覺重試時每個請求已評分的次數"""
+
+    def __init__(self, path: str = "vectorstore"):
+        self.path = path
+        self.hallucination_checks = {}
+
+    def reset(self, path: str):
+        self.path = path
+        self.hallucination_checks.clear()
+
+
+def grader_kind(system: str):
+    """依系統提示判斷是哪一個評分器"""
+    for keyword, kind in (
+        ("內容審核", "question"),
+        ("問題分類", "router"),
+        ("搜尋結果評估", "retrieval"),
+        ("答案準確性", "hallucination"),
+        ("回答品質", "answer"),
+    ):
+        if keyword in system:
+            return kind
+    return "generator"
+
+
+class FakeChatModel(BaseChatModel):
+    """依 Scenario 回應路由、評分與生成的 LLM 替身，支援 bind_tools 與 with_structured_output"""
+
+    latency: Any
+    scenario: Any
+    model: str = "fake-chat"
+    answer_chars: int = 300
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _get_ls_params(self, stop=None, **kwargs):
+        params = super()._get_ls_params(stop=stop, **kwargs)
+        params["ls_model_name"] = self.model
+        return params
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[tool.__name__ for tool in tools])
+
+    def with_structured_output(self, schema, **kwargs):
+        return self.bind(schema=schema.__name__) | RunnableLambda(
+            lambda message: schema.model_validate_json(message.content))
+
+    def verdict(self, kind, text):
+        path = self.scenario.path
+        if kind == "question":
+            return "yes" if path == "blocked" else "no"
+        if kind == "retrieval":
+            return "yes" if path != "web_retry" or WEB_MARKER in text else "no"
+        if kind == "hallucination" and path == "hallucination_retry":
+            tag = REQUEST_TAG.search(text)
+            key = tag.group(1) if tag else text
+            count = self.scenario.hallucination_checks.get(key, 0)
+            self.scenario.hallucination_checks[key] = count + 1
+            return "yes" if count == 0 else "no"
+        if kind == "hallucination":
+            return "no"
+        return "yes"
+
+    def respond(self, messages, kwargs):
+        system = messages[0].content if len(messages) > 1 else ""
+        human = messages[-1].content
+        kind = grader_kind(system)
+
+        if kwargs.get("tools"):
+            if self.scenario.path == "plain_answer":
+                return AIMessage(content="這個問題不需要查詢資料")
+            route = "vectorstore"
+            return AIMessage(content="", additional_kwargs={"tool_calls": [{
+                "id": "call_0", "type": "function",
+                "function": {"name": route, "arguments": json.dumps({"query": human}, ensure_ascii=False)},
+            }]})
+
+        if kwargs.get("schema") == "retrieval_grades":
+            documents = re.split(r"\n\n(?=\[\d+\] )", human)
+            return AIMessage(content=json.dumps(
+                {"scores": [self.verdict("retrieval", d) for d in documents]}))
+        if kwargs.get("schema"):
+            return AIMessage(content=json.dumps({"score": self.verdict(kind, human)}))
+        if kind != "generator":
+            return AIMessage(content=self.verdict(kind, human))
+
+        tag = REQUEST_TAG.search(human)
+        prefix = f"#{tag.group(1)} " if tag else ""
+        return AIMessage(content=prefix + "依據文件，" + "機車" * (self.answer_chars // 2))
+
+    def _result(self, messages, kwargs):
+        message = self.respond(messages, kwargs)
+        prompt_chars = sum(len(str(m.content)) for m in messages)
+        message.usage_metadata = {
+            "input_tokens": prompt_chars // 2,
+            "output_tokens": max(1, len(message.content) // 2),
+            "total_tokens": prompt_chars // 2 + max(1, len(message.content) // 2),
+        }
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency.sample())
+        return self._result(messages, kwargs)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency.sample())
+        return self._result(messages, kwargs)
+
+
+class FakeEmbeddings(Embeddings):
+    """以中文二元組雜湊成向量的 embedding 替身，相同文字得到相同向量"""
+
+    def __init__(self, latency, dimension: int = 256):
+        from services.bm25 import tokenize
+        self.tokenize = tokenize
+        self.latency = latency
+        self.dimension = dimension
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in self.tokenize(text):
+            vector[int(hashlib.md5(token.encode("utf-8")).hexdigest(), 16) % self.dimension] += 1.0
+        vector[0] += 1e-3
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency.sample())
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency.sample())
+        return self._embed(text)
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(self.latency.sample())
+        return [self._embed(t) for t in texts]
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(self.latency.sample())
+        return self._embed(text)
+
+
+class FakeTavily:
+    """回傳固定筆數結果的 Tavily 替身"""
+
+    def __init__(self, latency, max_results: int = 5):
+        self.latency = latency
+        self.max_results = max_results
+
+    async def ainvoke(self, payload):
+        await asyncio.sleep(self.latency.sample())
+        query = payload["query"]
+        return [
+            {"url": f"https://example.com/{i}", "content": f"{WEB_MARKER} 網路資料 {i}：{query}"}
+            for i in range(self.max_results)
+        ]
+
+
+def install_fakes(llm_latency, embed_latency, search_latency, scenario, answer_chars=300):
+    """以替身取代 get_openai_llm、GoogleGenerativeAIEmbeddings 與 TavilySearchResults"""
+    import services.llm
+    import services.embeddings
+    import services.web_search
+
+    def get_fake_llm(model="fake-chat", temperature=0.0, max_tokens=None):
+        return FakeChatModel(
+            latency=llm_latency, scenario=scenario, model=model, answer_chars=answer_chars)
+
+    services.llm.get_openai_llm = get_fake_llm
+    services.embeddings.GoogleGenerativeAIEmbeddings = lambda **kwargs: FakeEmbeddings(embed_latency)
+    services.web_search.TavilySearchResults = lambda **kwargs: FakeTavily(
+        search_latency, kwargs.get("max_results", 5))
@@ -0,0 +1,155 @@
+"""以卡帶錄製或重播一批問題，比較不同版本的延遲與路由決策
+
+用法:
+    # 錄製：實際呼叫 OpenAI、Google embedding 與 Tavily，寫入卡帶並保存這次的結果
+    CASSETTE_MODE=record python benchmarks/replay_questions.py questions.txt --output baseline.jsonl
+
+    # 重播：不連網，由卡帶回應（CASSETTE_LATENCY=zero 時不等待錄製時的耗時），並與錄製結果比較
+    CASSETTE_MODE=replay python benchmarks/replay_questions.py questions.txt --output candidate.jsonl \\
+        --compare baseline.jsonl
+
+questions.txt 每行一個問題，或為每行含 "question" 欄位的 JSON。
+問題經由 app.run_query 執行，checkpointer 改用記憶體、不保存對話歷史；語意快取預設停用，
+因為快取命中會略過 LLM 呼叫，使兩次執行走不同的路徑。
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 必須在匯入 config 之前設定
+os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+os.environ.setdefault("CASSETTE_MODE", "replay")
+
+import numpy as np  # noqa: E402
+
+# 目前問題的路由決策清單，節點在 LangGraph 建立的 task 中執行，會繼承此 context
+current_routes = contextvars.ContextVar("current_routes", default=None)
+
+
+class RouteRecorder:
+    """取代路由決策計數器，將決策記錄到目前問題的清單"""
+
+    def labels(self, router, decision):
+        class Counter:
+            def inc(self, amount=1):
+                routes = current_routes.get()
+                if routes is not None:
+                    routes.append([router, decision])
+        return Counter()
+
+
+def load_questions(path):
+    questions = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            questions.append(json.loads(line)["question"] if line.startswith("{") else line)
+    return questions
+
+
+def load_results(path):
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def summarize(label, results):
+    latencies = [r["latency_ms"] for r in results if r["error"] is None]
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (0, 0, 0)
+    errors = sum(r["error"] is not None for r in results)
+    print(f"{label:<10} n={len(results):>5} errors={errors:>4} "
+          f"p50={p50:8.1f}ms p95={p95:8.1f}ms p99={p99:8.1f}ms")
+
+
+def compare(baseline, candidate):
+    """比較兩次執行的延遲、路由決策與答案"""
+    summarize("baseline", baseline)
+    summarize("candidate", candidate)
+    by_question = {r["question"]: r for r in baseline}
+    route_changes = answer_changes = 0
+    for result in candidate:
+        old = by_question.get(result["question"])
+        if old is None:
+            continue
+        if old["routes"] != result["routes"]:
+            route_changes += 1
+            print(f"  route changed: {result['question']}")
+            print(f"    baseline:  {' > '.join(f'{r}={d}' for r, d in old['routes'])}")
+            print(f"    candidate: {' > '.join(f'{r}={d}' for r, d in result['routes'])}")
+        if old["answer"] != result["answer"]:
+            answer_changes += 1
+    print(f"route changes: {route_changes}  answer changes: {answer_changes}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("questions")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--compare")
+    parser.add_argument("--concurrency", type=int, default=1)
+    args = parser.parse_args()
+
+    import app
+    import services.metrics
+    from data.data import init_retriever
+    from services.cassette import get_cassette
+    from services.fast_router import fast_router
+    from config.config import FAST_ROUTER_ENABLED
+    from langgraph.checkpoint.memory import MemorySaver
+
+    async def no_history(*args, **kwargs):
+        return None
+
+    app.save_history = no_history
+    services.metrics.ROUTE_DECISIONS = RouteRecorder()
+    await asyncio.to_thread(init_retriever)
+    app._workflows["default"] = await app.create_workflow(checkpointer=MemorySaver())
+    if FAST_ROUTER_ENABLED:
+        await fast_router.setup()
+
+    questions = load_questions(args.questions)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run(index, question):
+        async with semaphore:
+            routes = []
+            current_routes.set(routes)
+            start = time.perf_counter()
+            answer = error = None
+            try:
+                answer = await app.run_query(question)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            return {
+                "index": index, "question": question, "answer": answer, "routes": routes,
+                "latency_ms": (time.perf_counter() - start) * 1000, "error": error,
+            }
+
+    # 每個問題在各自的 task 中執行，路由決策清單互不干擾
+    results = await asyncio.gather(*(
+        asyncio.create_task(run(i, q)) for i, q in enumerate(questions)))
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        for result in results:
+            file.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    cassette = get_cassette()
+    if cassette:
+        print(f"cassette {cassette.mode}: {cassette.stats}")
+        cassette.close()
+    if args.compare:
+        compare(load_results(args.compare), results)
+    else:
+        summarize(os.environ["CASSETTE_MODE"], results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,5 @@
 from dotenv import load_dotenv
+import json
 import os
 
 # 載入 .env 檔案
@@ -9,3 +10,130 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 DB_URI = os.getenv("DB_URI")
+
+# 向量索引設定
+PDF_URL = os.getenv(
+    "PDF_URL",
+    "https://www.freeway.gov.tw/Upload/Html/2017824171/inf/motorcycle%20safety_02.pdf")
+PDF_PATH = os.getenv("PDF_PATH", "motorcycle_safety_02.pdf")
+# 設定後改為掃描此目錄下所有 PDF，並以頁面雜湊增量更新索引
+SOURCE_DIR = os.getenv("SOURCE_DIR", "")
+# 並行解析與切分 PDF 的子行程數，1 表示在主行程中逐頁串流
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", "vector_store")
+# 文件切分的區塊字數與重疊字數；變更後需以 force 重建索引，未變動的頁面不會重新切分
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# 檢索評分設定：sequential（逐筆）、parallel（並行批次）、single_call（單次呼叫評分全部文件）
+RETRIEVAL_GRADE_MODE = os.getenv("RETRIEVAL_GRADE_MODE", "parallel")
+RETRIEVAL_GRADE_MAX_CONCURRENCY = int(
+    os.getenv("RETRIEVAL_GRADE_MAX_CONCURRENCY", "4"))
+
+# 推測執行：內容審核、問題路由與向量檢索同時進行
+SPECULATIVE_ROUTING = os.getenv("SPECULATIVE_ROUTING", "false").lower() == "true"
+
+# 幻覺檢查與回答品質評估並行執行
+PARALLEL_GENERATION_GRADING = os.getenv(
+    "PARALLEL_GENERATION_GRADING", "false").lower() == "true"
+
+# 語意答案快取
+SEMANTIC_CACHE_ENABLED = os.getenv(
+    "SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+SEMANTIC_CACHE_SYNC_INTERVAL = int(os.getenv("SEMANTIC_CACHE_SYNC_INTERVAL", "30"))
+
+# Embedding 模型與本地快取
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/embedding-001")
+EMBEDDING_CACHE_ENABLED = os.getenv(
+    "EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+
+# Embedding 批次排程：每批大小、並行批次數、每分鐘請求數與 token 數預算（0 表示不限）
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "0"))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", "0"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+
+# 向量資料庫後端：chroma 或 numpy（記憶體映射 .npy）
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+
+# 混合檢索：向量檢索與 BM25 以倒數排名融合（RRF）
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "4"))
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "10"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+
+# LLM 用戶端：共用 keep-alive 連線池，LLM_POOL_CONFIG 可依模型覆寫連線池設定，
+# 例如 {"gpt-4o-mini": {"max_connections": 50, "keepalive": false}}
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.7"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_KEEPALIVE = os.getenv("LLM_KEEPALIVE", "true").lower() == "true"
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_POOL_CONFIG = json.loads(os.getenv("LLM_POOL_CONFIG", "{}"))
+
+# 網路搜尋：每次查詢最多保留的結果數，以及依正規化查詢快取的秒數與筆數
+WEB_SEARCH_MAX_RESULTS = int(os.getenv("WEB_SEARCH_MAX_RESULTS", "5"))
+WEB_SEARCH_CACHE_TTL = int(os.getenv("WEB_SEARCH_CACHE_TTL", "3600"))
+WEB_SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("WEB_SEARCH_CACHE_MAX_ENTRIES", "1000"))
+
+# 生成與幻覺檢查時提示中文件內容的 token 上限
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+
+# 評分 LLM：structured 以結構化輸出回傳 yes/no，text 以限制輸出 token 數的文字回答並於本地解析
+GRADER_OUTPUT_MODE = os.getenv("GRADER_OUTPUT_MODE", "structured")
+GRADER_MAX_TOKENS = int(os.getenv("GRADER_MAX_TOKENS", "20"))
+GRADER_TEMPERATURE = float(os.getenv("GRADER_TEMPERATURE", "0"))
+# 評分預設使用的模型，GRADER_MODELS 可為個別評分器指定較快或較便宜的模型，
+# 例如 {"question_grader": "gpt-4.1-nano", "answer_grader": "gpt-4.1-nano"}
+GRADER_MODEL = os.getenv("GRADER_MODEL", LLM_MODEL)
+GRADER_MODELS = json.loads(os.getenv("GRADER_MODELS", "{}"))
+
+# 快速路由：以問題向量與主題中心點決定路由，相似度差距小於 margin 時改用 LLM 路由；
+# audit rate 為快速決定後在背景以 LLM 路由抽樣比對的比例
+FAST_ROUTER_ENABLED = os.getenv("FAST_ROUTER_ENABLED", "false").lower() == "true"
+FAST_ROUTER_MARGIN = float(os.getenv("FAST_ROUTER_MARGIN", "0.05"))
+FAST_ROUTER_AUDIT_RATE = float(os.getenv("FAST_ROUTER_AUDIT_RATE", "0.1"))
+
+# 本地預先審核：以詞庫判斷明確安全或不當的問題，不確定時才呼叫 LLM 審核；
+# lexicon 為自訂詞庫 JSON 路徑；strict 時只有明確不當的問題在本地判斷，其餘都交由 LLM 審核
+MODERATION_ENABLED = os.getenv("MODERATION_ENABLED", "false").lower() == "true"
+MODERATION_LEXICON = os.getenv("MODERATION_LEXICON", "")
+MODERATION_STRICT = os.getenv("MODERATION_STRICT", "false").lower() == "true"
+
+# 日誌：等級與格式（text 為 key=value，json 為每行一筆 JSON）
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# 錄製與重播：record 將 LLM、embedding 與網路搜尋的請求和回應寫入卡帶，replay 由卡帶回應不連網；
+# latency 為 recorded 時重播依錄製時的耗時等待，zero 時立即回傳
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off")
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", "./cassettes/cassette.jsonl.gz")
+CASSETTE_LATENCY = os.getenv("CASSETTE_LATENCY", "recorded")
+
+# 對話歷史：每個 session 保留的筆數與天數（0 表示不限天數），背景批次寫入的批次大小、
+# 等待秒數與佇列上限，過期記錄的清除間隔，以及 /history 行程內快取的秒數與 session 數
+HISTORY_RETENTION = int(os.getenv("HISTORY_RETENTION", "3"))
+HISTORY_MAX_AGE_DAYS = int(os.getenv("HISTORY_MAX_AGE_DAYS", "30"))
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "100"))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.5"))
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", "10000"))
+HISTORY_PRUNE_INTERVAL = int(os.getenv("HISTORY_PRUNE_INTERVAL", "3600"))
+HISTORY_CACHE_TTL = int(os.getenv("HISTORY_CACHE_TTL", "60"))
+HISTORY_CACHE_MAX_SESSIONS = int(os.getenv("HISTORY_CACHE_MAX_SESSIONS", "1000"))
+
+# LangGraph checkpoint：durability 為 sync（每步完成寫入後才繼續）、async（與下一步並行寫入）
+# 或 exit（只在流程結束時寫入）；backend 為 postgres 或 memory（記憶體保存，每 flush interval 秒
+# 將每個對話最新的 checkpoint 寫入 Postgres）；retention 為保存時數（0 表示不清除）
+CHECKPOINT_DURABILITY = os.getenv("CHECKPOINT_DURABILITY", "async")
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "postgres")
+CHECKPOINT_FLUSH_INTERVAL = float(os.getenv("CHECKPOINT_FLUSH_INTERVAL", "1.0"))
+CHECKPOINT_RETENTION_HOURS = float(os.getenv("CHECKPOINT_RETENTION_HOURS", "24"))
+CHECKPOINT_PRUNE_INTERVAL = int(os.getenv("CHECKPOINT_PRUNE_INTERVAL", "3600"))
+CHECKPOINT_PRUNE_BATCH = int(os.getenv("CHECKPOINT_PRUNE_BATCH", "500"))
@@ -1,27 +1,195 @@
-from langchain_community.document_loaders import PyPDFLoader
+import fcntl
+import glob
+import hashlib
+import os
+import re
+import shutil
+import threading
+from contextlib import contextmanager
 import requests
-from services.embeddings import EmbeddingService
+from chromadb.api.client import SharedSystemClient
+from services.embeddings import EmbeddingService, get_embedding_scheduler
+from services.bm25 import BM25Index, HybridRetriever
+from services.log import get_logger
+from data.ingest import (
+    compute_file_hash,
+    load_manifest,
+    save_manifest,
+    manifest_version,
+    update_index
+)
+from config.config import (
+    PDF_URL,
+    PDF_PATH,
+    SOURCE_DIR,
+    INGEST_WORKERS,
+    VECTOR_STORE_DIR,
+    VECTOR_BACKEND,
+    RETRIEVAL_K,
+    HYBRID_RETRIEVAL,
+    HYBRID_FETCH_K,
+    HYBRID_RRF_K
+)
 
+logger = get_logger(__name__)
 
-def load_documents():
-    """載入 PDF 文件"""
-    url = "https://www.freeway.gov.tw/Upload/Html/2017824171/inf/motorcycle%20safety_02.pdf"
-    pdf_path = "motorcycle_safety_02.pdf"
+# 記錄每個來源檔案每頁雜湊與區塊 ID 的索引清單
+MANIFEST_FILE = "manifest.json"
+# 與向量索引一同維護的 BM25 倒排索引
+BM25_FILE = "bm25.json"
+# 多個 worker 同時更新索引時使用的檔案鎖
+LOCK_FILE = ".lock"
+# 本模組建立的索引目錄：各後端名稱與舊版以內容雜湊命名的目錄
+BACKEND_DIRS = ("chroma", "numpy")
+LEGACY_INDEX_DIR = re.compile(r"^[0-9a-f]{16}$")
 
-    response = requests.get(url)
-    with open(pdf_path, "wb") as file:
-        file.write(response.content)
+# 行程內共用的檢索器
+_retriever = None
+_index_version = None
+_lock = threading.Lock()
 
-    loader = PyPDFLoader(pdf_path)
-    return loader.load()
 
+def download_document():
+    """下載 PDF 文件，內容有變動時才覆寫本地檔案"""
+    try:
+        response = requests.get(PDF_URL, timeout=30)
+        response.raise_for_status()
+        content = response.content
+    except requests.RequestException as e:
+        if not os.path.exists(PDF_PATH):
+            raise
+        logger.warning(f"下載 PDF 失敗，使用本地檔案: {str(e)}")
+        return
 
-def retrieve_documents():
-    """建立向量資料庫"""
+    if not os.path.exists(PDF_PATH) or compute_file_hash(PDF_PATH) != compute_content_hash(content):
+        with open(PDF_PATH, "wb") as file:
+            file.write(content)
+
+
+def compute_content_hash(content: bytes) -> str:
+    """計算文件內容雜湊"""
+    return hashlib.sha256(content).hexdigest()
+
+
+def list_sources():
+    """列出要建立索引的 PDF；未設定 SOURCE_DIR 時下載預設文件"""
+    if SOURCE_DIR:
+        return sorted(glob.glob(os.path.join(SOURCE_DIR, "**", "*.pdf"), recursive=True))
+    download_document()
+    return [PDF_PATH]
+
+
+@contextmanager
+def index_lock():
+    """以檔案鎖避免多個 worker 同時更新索引"""
+    os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
+    with open(os.path.join(VECTOR_STORE_DIR, LOCK_FILE), "w") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def update_bm25(index_dir, added, stale, rebuild):
+    """移除過期區塊並加入新區塊後重建 BM25 索引"""
+    path = os.path.join(index_dir, BM25_FILE)
+    documents = []
+    if os.path.exists(path) and not rebuild:
+        removed = stale | {d.metadata["chunk_id"] for d in added}
+        documents = [d for d in BM25Index.load(path).documents
+                     if d.metadata.get("chunk_id") not in removed]
+    bm25 = BM25Index.from_documents(documents + added)
+    bm25.save(path)
+    return bm25
+
+
+def build_index(force: bool = False):
+    """增量更新持久化向量資料庫，只嵌入新增或變動的區塊"""
+    index_dir = os.path.join(VECTOR_STORE_DIR, VECTOR_BACKEND)
     embedding_service = EmbeddingService()
 
-    # 載入文件並建立向量資料庫
-    documents = load_documents()
-    vectorstore = embedding_service.create_vectorstore(documents)
-    retriever = vectorstore.as_retriever()
-    return retriever
+    with index_lock():
+        sources = list_sources()
+        remove_stale_indexes(VECTOR_BACKEND)
+
+        manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+        manifest = load_manifest(manifest_path)
+        rebuild = force or not manifest["files"] or not os.path.exists(
+            os.path.join(index_dir, BM25_FILE))
+        if rebuild:
+            # 強制重建或清單與 BM25 不一致時從頭建立；Chroma 依路徑快取用戶端，刪除目錄前需清除
+            SharedSystemClient.clear_system_cache()
+            shutil.rmtree(index_dir, ignore_errors=True)
+            manifest = {"files": {}}
+        os.makedirs(index_dir, exist_ok=True)
+
+        vectorstore = embedding_service.load_vectorstore(index_dir)
+        added, stale, stats = update_index(
+            vectorstore, manifest, sources, embedding_service.text_splitter,
+            workers=INGEST_WORKERS)
+        version = manifest_version(manifest)
+        logger.info("vector index updated", extra={"version": version, **stats})
+        if added:
+            get_embedding_scheduler().report()
+
+        if added or stale or rebuild:
+            bm25 = update_bm25(index_dir, added, stale, rebuild)
+        else:
+            bm25 = BM25Index.load(os.path.join(index_dir, BM25_FILE))
+        save_manifest(manifest_path, manifest)
+
+    return vectorstore, bm25, version
+
+
+def remove_stale_indexes(current: str):
+    """刪除其他後端或舊版格式的索引目錄，VECTOR_STORE_DIR 中的其他目錄不受影響"""
+    for name in os.listdir(VECTOR_STORE_DIR):
+        path = os.path.join(VECTOR_STORE_DIR, name)
+        if name == current or not os.path.isdir(path) or os.path.islink(path):
+            continue
+        if name in BACKEND_DIRS or LEGACY_INDEX_DIR.match(name):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def init_retriever(force: bool = False):
+    """於啟動時建立行程內共用的檢索器"""
+    global _retriever, _index_version
+    with _lock:
+        if _retriever is not None and not force:
+            return _retriever
+        vectorstore, bm25, version = build_index(force)
+        _retriever = create_retriever(vectorstore, bm25)
+        _index_version = version
+    return _retriever
+
+
+def create_retriever(vectorstore, bm25):
+    """建立向量檢索器，啟用混合檢索時與 BM25 以 RRF 融合"""
+    if not HYBRID_RETRIEVAL:
+        return vectorstore.as_retriever(search_kwargs={"k": RETRIEVAL_K})
+    return HybridRetriever(
+        vector_retriever=vectorstore.as_retriever(
+            search_kwargs={"k": HYBRID_FETCH_K}),
+        bm25=bm25,
+        k=RETRIEVAL_K,
+        fetch_k=HYBRID_FETCH_K,
+        rrf_k=HYBRID_RRF_K,
+    )
+
+
+def get_retriever():
+    """取得共用檢索器，尚未初始化時建立"""
+    if _retriever is None:
+        return init_retriever()
+    return _retriever
+
+
+def get_index_version():
+    """取得目前索引版本"""
+    return _index_version
+
+
+def retrieve_documents():
+    """取得向量資料庫檢索器"""
+    return get_retriever()
@@ -0,0 +1,187 @@
+from langchain_community.document_loaders import PyPDFLoader
+from concurrent.futures import ProcessPoolExecutor
+from services.embeddings import create_text_splitter
+import hashlib
+import json
+import os
+import time
+
+# 每批送往向量資料庫的區塊數，由 embedding 排程器再切分為並行的請求
+INGEST_BATCH_SIZE = 512
+
+
+def compute_file_hash(path: str) -> str:
+    """計算檔案內容雜湊"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def compute_text_hash(text: str) -> str:
+    """計算文字雜湊"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(source: str, page: int, index: int, content: str) -> str:
+    """以來源、頁碼與內容產生穩定的區塊 ID"""
+    return compute_text_hash(f"{source}\x00{page}\x00{index}\x00{content}")[:32]
+
+
+def load_manifest(path: str):
+    """載入索引清單，記錄每個檔案每頁的雜湊與區塊 ID"""
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_manifest(path: str, manifest):
+    """寫入索引清單"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def manifest_version(manifest) -> str:
+    """以所有區塊 ID 計算索引版本"""
+    ids = sorted(
+        chunk
+        for entry in manifest["files"].values()
+        for page in entry["pages"].values()
+        for chunk in page["chunks"])
+    return compute_text_hash("\n".join(ids))[:16]
+
+
+def split_page(source: str, page_number: int, page, splitter):
+    """切分單頁並標記區塊 ID"""
+    chunks = splitter.split_documents([page])
+    for index, chunk in enumerate(chunks):
+        chunk.metadata["chunk_id"] = chunk_id(
+            source, page_number, index, chunk.page_content)
+    return chunks
+
+
+def iter_file_chunks(source: str, old_entry, new_entry, splitter):
+    """逐頁串流讀取檔案，只切分內容有變動的頁面
+
+    new_entry["pages"] 會記錄每頁的雜湊與區塊 ID，供呼叫端比對需刪除的舊區塊。
+    """
+    old_pages = old_entry["pages"] if old_entry else {}
+    for page_number, page in enumerate(PyPDFLoader(source).lazy_load()):
+        key = str(page_number)
+        page_hash = compute_text_hash(page.page_content)
+        old_page = old_pages.get(key)
+        if old_page and old_page["hash"] == page_hash:
+            new_entry["pages"][key] = old_page
+            continue
+
+        chunks = split_page(source, page_number, page, splitter)
+        new_entry["pages"][key] = {
+            "hash": page_hash,
+            "chunks": [c.metadata["chunk_id"] for c in chunks],
+        }
+        yield from chunks
+
+
+def new_file_entry(source: str, stat):
+    """建立檔案清單項目"""
+    return {"size": stat.st_size, "mtime": stat.st_mtime,
+            "sha256": compute_file_hash(source), "pages": {}}
+
+
+def chunk_file(source: str, old_entry):
+    """於子行程中解析並切分單一檔案，回傳 (清單項目, 區塊)"""
+    new_entry = new_file_entry(source, os.stat(source))
+    chunks = list(iter_file_chunks(
+        source, old_entry, new_entry, create_text_splitter()))
+    return new_entry, chunks
+
+
+def iter_changed_files(changed, files, splitter, workers: int = 1):
+    """依輸入順序產生 (來源, 清單項目, 區塊)
+
+    workers 大於 1 時以行程池並行解析與切分，結果仍依原順序回傳；
+    否則在目前行程中逐頁串流。
+    """
+    if workers > 1 and len(changed) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                chunk_file, changed, [files.get(s) for s in changed])
+            for source, (new_entry, chunks) in zip(changed, results):
+                yield source, new_entry, chunks
+        return
+
+    for source in changed:
+        new_entry = new_file_entry(source, os.stat(source))
+        yield source, new_entry, iter_file_chunks(
+            source, files.get(source), new_entry, splitter)
+
+
+def entry_chunk_ids(entry):
+    """取得檔案清單項目中的所有區塊 ID"""
+    if not entry:
+        return set()
+    return {chunk for page in entry["pages"].values() for chunk in page["chunks"]}
+
+
+def is_unchanged(source: str, entry, stat) -> bool:
+    """以大小與修改時間判斷，必要時比對檔案雜湊"""
+    if not entry:
+        return False
+    if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+        return True
+    if entry["size"] == stat.st_size and entry["sha256"] == compute_file_hash(source):
+        entry["mtime"] = stat.st_mtime
+        return True
+    return False
+
+
+def update_index(vectorstore, manifest, sources, splitter, workers: int = 1):
+    """增量更新向量資料庫：只嵌入新增或變動的區塊，並刪除過期區塊
+
+    回傳 (新增區塊, 刪除的區塊 ID, 統計資料)。
+    """
+    start = time.perf_counter()
+    stats = {"files": len(sources), "skipped": 0, "changed": 0, "removed_files": 0,
+             "added_chunks": 0, "removed_chunks": 0}
+    added = []
+    stale = set()
+    batch = []
+
+    def flush():
+        if batch:
+            vectorstore.add_documents(
+                batch, ids=[c.metadata["chunk_id"] for c in batch])
+            added.extend(batch)
+            batch.clear()
+
+    files = manifest["files"]
+    changed = [s for s in sources if not is_unchanged(s, files.get(s), os.stat(s))]
+    stats["skipped"] = len(sources) - len(changed)
+    stats["changed"] = len(changed)
+
+    for source, new_entry, chunks in iter_changed_files(changed, files, splitter, workers):
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) >= INGEST_BATCH_SIZE:
+                flush()
+        stale |= entry_chunk_ids(files.get(source)) - entry_chunk_ids(new_entry)
+        files[source] = new_entry
+    flush()
+
+    for source in set(files) - set(sources):
+        stats["removed_files"] += 1
+        stale |= entry_chunk_ids(files.pop(source))
+
+    # 內容相同的區塊 ID 不變，已重新加入者不可刪除
+    stale -= {c.metadata["chunk_id"] for c in added}
+    if stale:
+        vectorstore.delete(ids=sorted(stale))
+
+    stats["added_chunks"] = len(added)
+    stats["removed_chunks"] = len(stale)
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    return added, stale, stats
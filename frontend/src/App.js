@@ -1,18 +1,39 @@
 import React, { useState, useEffect } from 'react'
 import './App.css'
 
+// 瀏覽器保存的 session 識別碼，對話歷史依此區分
+const getSessionId = () => {
+  let sessionId = localStorage.getItem('session_id')
+  if (!sessionId) {
+    sessionId = crypto.randomUUID()
+    localStorage.setItem('session_id', sessionId)
+  }
+  return sessionId
+}
+
+// 串流進度顯示的節點名稱
+const NODE_LABELS = {
+  retrieve: '正在檢索法規資料...',
+  web_search: '正在搜尋網路資料...',
+  retrieval_grade: '正在評估資料相關性...',
+  rag_generate: '正在生成回答...',
+  plain_answer: '正在生成回答...',
+}
+
 function App() {
   const [question, setQuestion] = useState('')
   const [answer, setAnswer] = useState('')
   const [isLoading, setIsLoading] = useState(false)
   const [error, setError] = useState('')
   const [history, setHistory] = useState([])
+  const [progress, setProgress] = useState('')
+  const [sessionId] = useState(getSessionId)
 
   // 獲取歷史記錄
   const fetchHistory = async () => {
     try {
       console.log('正在獲取歷史記錄...');  // 添加日誌
-      const response = await fetch('http://localhost:8000/history')
+      const response = await fetch(`http://localhost:8000/history?session_id=${encodeURIComponent(sessionId)}`)
       console.log('歷史記錄回應:', response);  // 添加日誌
       
       if (!response.ok) {
@@ -49,14 +70,15 @@ function App() {
     setIsLoading(true)
     setAnswer('')
     setError('')
+    setProgress('')
 
     try {
-      const response = await fetch('http://localhost:8000/query', {
+      const response = await fetch('http://localhost:8000/query/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ text: question })
+        body: JSON.stringify({ text: question, session_id: sessionId })
       })
 
       if (!response.ok) {
@@ -64,14 +86,47 @@ function App() {
         throw new Error(errorData.detail || '請求失敗')
       }
 
-      const data = await response.json()
-      setAnswer(data.response)
+      // 逐段讀取 Server-Sent Events
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      let draft = ''
+
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+
+        const messages = buffer.split('\n\n')
+        buffer = messages.pop()
+        for (const message of messages) {
+          if (!message.startsWith('data: ')) continue
+          const event = JSON.parse(message.slice(6))
+
+          if (event.type === 'node') {
+            setProgress(NODE_LABELS[event.node] || event.node)
+            // 生成節點重新開始（重試）時清除草稿
+            if (event.node === 'rag_generate' || event.node === 'plain_answer') {
+              draft = ''
+              setAnswer('')
+            }
+          } else if (event.type === 'token') {
+            draft += event.content
+            setAnswer(draft)
+          } else if (event.type === 'final') {
+            setAnswer(event.answer)
+          } else if (event.type === 'error') {
+            throw new Error(event.detail || '請求失敗')
+          }
+        }
+      }
       await fetchHistory()  // 在獲得回答後更新歷史記錄
     } catch (error) {
       console.error('Error:', error)
       setError(error.message || '發生錯誤，請稍後再試')
     } finally {
       setIsLoading(false)
+      setProgress('')
     }
   }
 
@@ -90,7 +145,7 @@ function App() {
           {isLoading ? '處理中...' : '送出問題'}
         </button>
       </form>
-      {isLoading && <div className="loading">正在思考中...</div>}
+      {isLoading && <div className="loading">{progress || '正在思考中...'}</div>}
       {error && <div className="error">{error}</div>}
       {answer && (
         <div className="answer">
@@ -1,5 +1,5 @@
 import asyncio
-from app import run_query_with_timeout
+from app import run_query_with_timeout, history
 
 
 async def test_query():
@@ -9,6 +9,8 @@ async def test_query():
         print(answer)
     except Exception as e:
         print(f"錯誤：{str(e)}")
+    finally:
+        await history.close()  # 等待對話歷史寫入資料庫
 
 if __name__ == "__main__":
     asyncio.run(test_query())
@@ -5,6 +5,7 @@ from langchain.schema import Document
 class GraphState(TypedDict):
     """圖狀態類別"""
     question: str
+    conversation_id: Optional[str]
     generation: Optional[str]
     documents: Optional[List[Document]]
     web_search_retry_count: Optional[int]
@@ -1,14 +1,17 @@
 from langchain_core.prompts import ChatPromptTemplate
 from services.llm import get_openai_llm
+from services.context import pack_context
+from services.log import get_logger
 from langchain_core.output_parsers import StrOutputParser
 
+logger = get_logger(__name__)
+
+# 標記生成回答的 LLM 呼叫，供串流時與評分 LLM 區分
+ANSWER_STREAM_TAG = "answer_stream"
 
-def rag_generate(state):
-    """使用 RAG 生成回答"""
-    print("---RAG GENERATE---")
-    question = state["question"]
-    documents = state["documents"]
 
+def create_rag_chain():
+    """創建 RAG 生成回答的 chain"""
     instruction = """
     你是一位專業的問答助手，請依照以下規則回應問題：
 
@@ -31,22 +34,12 @@ def rag_generate(state):
     # LLM & chain
     # llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro", temperature=0.7)
     llm = get_openai_llm()
-    rag_chain = prompt | llm | StrOutputParser()
-
-    # RAG generation
-    generation = rag_chain.invoke(
-        {"documents": documents, "question": question})
-
-    # 更新 state 並回傳
-    state["generation"] = generation
-    return state
+    return (prompt | llm | StrOutputParser()).with_config(
+        tags=[ANSWER_STREAM_TAG])
 
 
-def plain_answer(state):
-    """直接使用 LLM 生成回答"""
-    print("---GENERATE PLAIN ANSWER---")
-    question = state["question"]
-
+def create_plain_chain():
+    """創建直接生成回答的 chain"""
     instruction = """
     你是一位專業的問答助手，請依照以下規則回應問題：
 
@@ -66,9 +59,36 @@ def plain_answer(state):
 
     # LLM & chain
     llm = get_openai_llm()
-    llm_chain = prompt | llm | StrOutputParser()
+    return (prompt | llm | StrOutputParser()).with_config(
+        tags=[ANSWER_STREAM_TAG])
+
+
+# 於匯入時建立，所有請求共用同一組 chain 與 LLM 用戶端
+rag_chain = create_rag_chain()
+plain_chain = create_plain_chain()
+
+
+async def rag_generate(state):
+    """使用 RAG 生成回答"""
+    question = state["question"]
+    documents = state["documents"]
+    logger.debug("rag generate", extra={"documents": len(documents)})
+
+    # RAG generation，文件先組成有 token 上限的提示內容
+    generation = await rag_chain.ainvoke(
+        {"documents": pack_context(documents), "question": question})
+
+    # 更新 state 並回傳
+    state["generation"] = generation
+    return state
+
+
+async def plain_answer(state):
+    """直接使用 LLM 生成回答"""
+    logger.debug("generate plain answer")
+    question = state["question"]
 
-    generation = llm_chain.invoke({"question": question})
+    generation = await plain_chain.ainvoke({"question": question})
 
     # 更新 state 並回傳
     state["generation"] = generation
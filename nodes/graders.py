@@ -1,59 +1,184 @@
 from services.llm_model import (
     question_grader,
     retrieval_grader,
+    batch_retrieval_grader,
     hallucination_grader,
     answer_grader,
-    question_router
+    question_router,
+    parse_verdict
 )
+from services.context import pack_context
+from services.fast_router import fast_router
+from services.moderation import pre_moderator
+from services.metrics import RETRIES
+from services.log import get_logger
+from nodes.retrievers import get_speculative_retrieval
+from config.config import (
+    RETRIEVAL_GRADE_MODE,
+    RETRIEVAL_GRADE_MAX_CONCURRENCY,
+    SPECULATIVE_ROUTING,
+    PARALLEL_GENERATION_GRADING,
+    FAST_ROUTER_ENABLED,
+    MODERATION_ENABLED
+)
+import asyncio
+
+logger = get_logger(__name__)
+
+
+def parse_route(source):
+    """解析問題路由 LLM 的工具選擇"""
+    # Fallback to plain LLM or raise error if no decision
+    if "tool_calls" not in source.additional_kwargs:
+        logger.debug("route question", extra={"route": "plain_answer"})
+        return "plain_answer"
+    if len(source.additional_kwargs["tool_calls"]) == 0:
+        raise ValueError("Router could not decide source")
+
+    # Choose datasource
+    datasource = source.additional_kwargs["tool_calls"][0]["function"]["name"]
+    if datasource == "web_search":
+        logger.debug("route question", extra={"route": "web_search"})
+        return "web_search"
+    elif datasource == "vectorstore":
+        logger.debug("route question", extra={"route": "vectorstore"})
+        return "vectorstore"
+
+
+async def grade_question(question):
+    """內容審核，先以本地詞庫判斷，不確定時才呼叫 LLM 審核"""
+    if MODERATION_ENABLED:
+        grade = pre_moderator.check(question)
+        if grade is not None:
+            return grade
+    score = await question_grader.ainvoke({"question": question})
+    return parse_verdict(score)
+
+
+async def route_with_llm(question):
+    """以 LLM 問題路由決定資料來源"""
+    source = await question_router.ainvoke({"question": question})
+    return parse_route(source)
 
 
-def route_question(state):
+async def route_fast(question):
+    """以快速路由決定資料來源，模糊時回傳 None；抽樣在背景與 LLM 路由比對"""
+    route = await fast_router.route(question)
+    if route is not None and fast_router.should_audit():
+        fast_router.start_audit(route, route_with_llm(question))
+    return route
+
+
+async def route_question(state):
     """評估問題是否適合回答"""
-    print("---QUESTION---")
+    if SPECULATIVE_ROUTING:
+        return await route_question_speculative(state)
+
+    logger.debug("grade question")
     question = state["question"]
 
-    score = question_grader.invoke({"question": question})
-    grade = score.content
+    grade = await grade_question(question)
     if grade == "yes":
         return "end"
     else:
-        print("---ROUTE QUESTION---")
+        if FAST_ROUTER_ENABLED:
+            route = await route_fast(question)
+            if route is not None:
+                return route
+        return await route_with_llm(question)
 
-        source = question_router.invoke({"question": question})
 
-        # Fallback to plain LLM or raise error if no decision
-        if "tool_calls" not in source.additional_kwargs:
-            print("  -ROUTE TO PLAIN LLM-")
-            return "plain_answer"
-        if len(source.additional_kwargs["tool_calls"]) == 0:
-            raise "Router could not decide source"
+async def route_question_speculative(state):
+    """同時執行內容審核、問題路由與向量檢索，審核未通過時捨棄推測結果"""
+    logger.debug("grade question", extra={"speculative": True})
+    question = state["question"]
+
+    speculative = get_speculative_retrieval()
+    if speculative is not None:
+        speculative.start(question)
+    grade_task = asyncio.create_task(grade_question(question))
+    # 啟用快速路由時只在其無法決定時才呼叫 LLM 路由
+    fast_task = route_task = None
+    if FAST_ROUTER_ENABLED:
+        fast_task = asyncio.create_task(route_fast(question))
+    else:
+        route_task = asyncio.create_task(route_with_llm(question))
+
+    route = None
+    keep = False
+    try:
+        if fast_task is not None:
+            route = await fast_task
+            if route is None:
+                route_task = asyncio.create_task(route_with_llm(question))
+
+        if await grade_task == "yes":
+            return "end"
 
-        # Choose datasource
-        datasource = source.additional_kwargs["tool_calls"][0]["function"]["name"]
-        if datasource == "web_search":
-            print("  -ROUTE TO WEB SEARCH-")
-            return "web_search"
-        elif datasource == "vectorstore":
-            print("  -ROUTE TO VECTORSTORE-")
-            return "vectorstore"
+        if route is None:
+            route = await route_task
+        keep = route == "vectorstore"
+        return route
+    finally:
+        grade_task.cancel()
+        for task in (fast_task, route_task):
+            if task is not None:
+                task.cancel()
+        # 審核未通過、路由到其他來源或發生例外時都捨棄推測檢索
+        if not keep and speculative is not None:
+            speculative.discard()
 
 
-def retrieval_grade(state):
+async def grade_documents_sequential(question, documents):
+    """逐筆評估文件相關性"""
+    grades = []
+    for d in documents:
+        score = await retrieval_grader.ainvoke(
+            {"question": question, "document": d.page_content})
+        grades.append(parse_verdict(score))
+    return grades
+
+
+async def grade_documents_parallel(question, documents):
+    """以有上限的並行數批次評估文件相關性，結果順序與輸入一致"""
+    scores = await retrieval_grader.abatch(
+        [{"question": question, "document": d.page_content} for d in documents],
+        config={"max_concurrency": RETRIEVAL_GRADE_MAX_CONCURRENCY},
+    )
+    return [parse_verdict(score) for score in scores]
+
+
+async def grade_documents_single_call(question, documents):
+    """以單次 LLM 呼叫評估所有文件相關性"""
+    numbered = "\n\n".join(
+        f"[{i}] {d.page_content}" for i, d in enumerate(documents, start=1))
+    result = await batch_retrieval_grader.ainvoke(
+        {"question": question, "documents": numbered})
+    if len(result.scores) != len(documents):
+        logger.warning("single call grade count mismatch, fallback to parallel", extra={
+            "documents": len(documents), "scores": len(result.scores)})
+        return await grade_documents_parallel(question, documents)
+    return [parse_verdict(score) for score in result.scores]
+
+
+GRADE_DOCUMENTS = {
+    "sequential": grade_documents_sequential,
+    "parallel": grade_documents_parallel,
+    "single_call": grade_documents_single_call,
+}
+
+
+async def retrieval_grade(state):
     """評估檢索結果是否相關"""
-    print("---GRADE RETRIEVAL---")
     question = state["question"]
     documents = state["documents"]
 
-    filtered_docs = []
-    for d in documents:
-        score = retrieval_grader.invoke(
-            {"question": question, "document": d.page_content})
-        grade = score.content
-        if grade == "yes":
-            print("  -GRADE: DOCUMENT RELEVANT-")
-            filtered_docs.append(d)
-        else:
-            print("  -GRADE: DOCUMENT NOT RELEVANT-")
+    grade_documents = GRADE_DOCUMENTS[RETRIEVAL_GRADE_MODE]
+    grades = await grade_documents(question, documents) if documents else []
+
+    filtered_docs = [d for d, grade in zip(documents, grades) if grade == "yes"]
+    logger.debug("grade retrieval", extra={
+        "mode": RETRIEVAL_GRADE_MODE, "documents": len(documents), "relevant": len(filtered_docs)})
 
     # 更新 state 並回傳
     state["documents"] = filtered_docs
@@ -64,6 +189,7 @@ def update_web_search(state):
     """更新重試次數"""
     retry_count = state["web_search_retry_count"]
     state["web_search_retry_count"] = retry_count + 1
+    RETRIES.labels("web_search").inc()
     return state
 
 
@@ -71,61 +197,76 @@ def update_rag_generate(state):
     """更新重試次數"""
     retry_count = state["rag_generate_retry_count"]
     state["rag_generate_retry_count"] = retry_count + 1
+    RETRIES.labels("rag_generate").inc()
     return state
 
 
-def grade_rag_generation(state):
+async def grade_rag_generation(state):
     """評估生成內容是否合適"""
-    print("---CHECK HALLUCINATIONS---")
     question = state["question"]
     documents = state["documents"]
     generation = state["generation"]
     rag_generate_retry_count = state["rag_generate_retry_count"]
     web_search_retry_count = state["web_search_retry_count"]
 
-    score = hallucination_grader.invoke(
-        {"documents": documents, "generation": generation})
-    grade = score.content
-
-    # 檢查幻覺
-    if grade == "no":
-        print("  -DECISION: GENERATION IS GROUNDED IN DOCUMENTS-")
-        # 檢查問題回答
-        print("---GRADE GENERATION vs QUESTION---")
-        score = answer_grader.invoke(
-            {"question": question, "generation": generation})
-        grade = score.content
-        if grade == "yes":
-            print("  -DECISION: GENERATION ADDRESSES QUESTION-")
-            return "useful"
+    # 並行模式下先啟動回答品質評估，幻覺檢查未通過時取消
+    answer_task = None
+    if PARALLEL_GENERATION_GRADING:
+        answer_task = asyncio.create_task(answer_grader.ainvoke(
+            {"question": question, "generation": generation}))
+
+    try:
+        # 與 rag_generate 使用相同的提示內容，避免以未提供給模型的文件判斷
+        score = await hallucination_grader.ainvoke(
+            {"documents": pack_context(documents), "generation": generation})
+        # 無法判斷時視為有幻覺，改走重試流程
+        grade = parse_verdict(score, default="yes")
+
+        # 檢查幻覺
+        if grade == "no":
+            logger.debug("generation is grounded in documents")
+            # 檢查問題回答
+            if answer_task is not None:
+                score = await answer_task
+            else:
+                score = await answer_grader.ainvoke(
+                    {"question": question, "generation": generation})
+            grade = parse_verdict(score)
+            if grade == "yes":
+                logger.debug("generation addresses question")
+                return "useful"
+            else:
+                logger.debug("generation does not address question")
+                if web_search_retry_count >= 1:
+                    logger.info("max retries reached, using plain answer", extra={
+                        "web_search_retry_count": web_search_retry_count})
+                    return "plain_answer"
+                return "not useful"
         else:
-            print("  -DECISION: GENERATION DOES NOT ADDRESS QUESTION-")
-            if web_search_retry_count >= 1:
-                print("  -MAX RETRIES REACHED, USING PLAIN ANSWER-")
+            logger.debug("generation is not grounded in documents, retry")
+            if rag_generate_retry_count >= 1:
+                logger.info("max retries reached, using plain answer", extra={
+                    "rag_generate_retry_count": rag_generate_retry_count})
                 return "plain_answer"
-            return "not useful"
-    else:
-        print("  -DECISION: GENERATION IS NOT GROUNDED IN DOCUMENTS, RE-TRY-")
-        if rag_generate_retry_count >= 1:
-            print("  -MAX RETRIES REACHED, USING PLAIN ANSWER-")
-            return "plain_answer"
-        return "not supported"
+            return "not supported"
+    finally:
+        if answer_task is not None:
+            answer_task.cancel()
 
 
 def route_retrieval(state):
     """決定是否生成答案或使用網路搜尋"""
-    print("---ROUTE RETRIEVAL---")
     documents = state["documents"]
     retry_count = state["web_search_retry_count"]
 
     if not documents:
-        print("  -NO RELEVANT DOCUMENTS FOUND-")
         if retry_count >= 1:
-            print("  -MAX RETRIES REACHED, USING PLAIN ANSWER-")
+            logger.info("no relevant documents, max retries reached, using plain answer", extra={
+                "web_search_retry_count": retry_count})
             return "plain_answer"
 
-        print("  -RETRY WITH WEB SEARCH-")
+        logger.debug("no relevant documents, retry with web search")
         return "web_search"
 
-    print("  -RELEVANT DOCUMENTS FOUND, GENERATING ANSWER-")
+    logger.debug("relevant documents found, generating answer", extra={"documents": len(documents)})
     return "rag_generate"
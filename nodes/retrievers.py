@@ -1,31 +1,71 @@
-from langchain_community.tools.tavily_search import TavilySearchResults
-from langchain.schema import Document
-from data.data import retrieve_documents
-from config.config import TAVILY_API_KEY
+from data.data import get_retriever
+from services.web_search import get_web_search, dedupe_documents
+from services.log import get_logger
+from langgraph.config import get_config
+import asyncio
 
+logger = get_logger(__name__)
 
-def web_search(state):
+# 查詢設定中保存推測檢索的鍵
+SPECULATIVE_KEY = "speculative_retrieval"
+
+
+class SpeculativeRetrieval:
+    """一次查詢在路由決定前先行啟動的向量檢索，由執行查詢的一方於結束時 discard"""
+
+    def __init__(self):
+        self.task = None
+
+    def start(self, question):
+        """先行啟動向量檢索"""
+        if self.task is None:
+            self.task = asyncio.create_task(get_retriever().ainvoke(question))
+
+    def take(self):
+        """取出檢索 task，之後不再由本物件取消"""
+        task, self.task = self.task, None
+        return task
+
+    def discard(self):
+        """取消未使用的檢索"""
+        task = self.take()
+        if task is not None:
+            task.cancel()
+
+
+def get_speculative_retrieval():
+    """取得目前查詢的推測檢索，查詢設定中沒有時回傳 None"""
+    try:
+        return get_config().get("configurable", {}).get(SPECULATIVE_KEY)
+    except RuntimeError:
+        return None
+
+
+async def web_search(state):
     """執行網路搜尋"""
-    print("---WEB SEARCH---")
     question = state["question"]
     documents = state.get("documents", [])
 
-    search_tool = TavilySearchResults(api_key=TAVILY_API_KEY)
-    results = search_tool.invoke({"query": question})
-    web_results = [Document(page_content=d["content"]) for d in results]
+    web_results = await get_web_search().search(question)
+    logger.debug("web search", extra={"results": len(web_results)})
 
-    documents.extend(web_results)
-    state["documents"] = documents
+    # 重試時可能再次取得相同片段，依內容去除重複
+    state["documents"] = dedupe_documents(documents + web_results)
     return state
 
 
-def retrieve(state):
+async def retrieve(state):
     """從向量資料庫檢索文件"""
-    print("---RETRIEVE---")
     question = state["question"]
 
-    retriever = retrieve_documents()
-    documents = retriever.invoke(question)
+    speculative = get_speculative_retrieval()
+    task = speculative.take() if speculative is not None else None
+    if task is not None:
+        documents = await task
+    else:
+        retriever = get_retriever()
+        documents = await retriever.ainvoke(question)
+    logger.debug("retrieve", extra={"documents": len(documents), "speculative": task is not None})
 
     state["documents"] = documents
     return state
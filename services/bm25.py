@@ -0,0 +1,140 @@
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.documents import Document
+from typing import Any, List
+from collections import Counter, defaultdict
+import asyncio
+import json
+import math
+import re
+
+# 中日韓文字區段，其餘連續英數字視為一個詞
+CJK_PATTERN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+|[A-Za-z0-9]+")
+
+
+def tokenize(text: str):
+    """中文以字元二元組切分，英數字以單詞切分"""
+    tokens = []
+    for run in CJK_PATTERN.findall(text):
+        if run.isascii():
+            tokens.append(run.lower())
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """以倒排索引實作的 BM25 檢索"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents = []
+        self.doc_lengths = []
+        self.postings = {}
+        self.avg_length = 0.0
+
+    @classmethod
+    def from_documents(cls, documents, **kwargs):
+        index = cls(**kwargs)
+        index.add_documents(documents)
+        return index
+
+    def add_documents(self, documents):
+        """加入文件並更新倒排索引"""
+        postings = defaultdict(list, self.postings)
+        for document in documents:
+            doc_index = len(self.documents)
+            counts = Counter(tokenize(document.page_content))
+            self.documents.append(document)
+            self.doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings[term].append((doc_index, tf))
+        self.postings = dict(postings)
+        self.avg_length = sum(self.doc_lengths) / max(len(self.doc_lengths), 1)
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        n = len(self.documents)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int = 4):
+        """回傳 (文件, 分數) 依分數排序"""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for doc_index, tf in postings:
+                norm = 1 - self.b + self.b * self.doc_lengths[doc_index] / self.avg_length
+                scores[doc_index] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.documents[i], score) for i, score in ranked]
+
+    def save(self, path: str):
+        """寫入 JSON 檔"""
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "documents": [
+                    {"page_content": d.page_content, "metadata": d.metadata}
+                    for d in self.documents
+                ],
+                "doc_lengths": self.doc_lengths,
+                "postings": self.postings,
+            }, file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str):
+        """自 JSON 檔載入"""
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+        index = cls(k1=data["k1"], b=data["b"])
+        index.documents = [Document(**d) for d in data["documents"]]
+        index.doc_lengths = data["doc_lengths"]
+        index.postings = {
+            term: [tuple(p) for p in postings] for term, postings in data["postings"].items()}
+        index.avg_length = sum(index.doc_lengths) / max(len(index.doc_lengths), 1)
+        return index
+
+
+def document_key(document: Document):
+    """以內容與頁碼辨識同一份文件"""
+    return (document.page_content, document.metadata.get("source"), document.metadata.get("page"))
+
+
+def reciprocal_rank_fusion(result_lists, k: int, rrf_k: int = 60):
+    """以倒數排名融合多個排序結果"""
+    scores = defaultdict(float)
+    documents = {}
+    for results in result_lists:
+        for rank, document in enumerate(results):
+            key = document_key(document)
+            scores[key] += 1.0 / (rrf_k + rank + 1)
+            documents.setdefault(key, document)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in ranked]
+
+
+class HybridRetriever(BaseRetriever):
+    """結合向量檢索與 BM25 關鍵字檢索，以 RRF 融合結果"""
+
+    vector_retriever: Any
+    bm25: Any
+    k: int = 4
+    fetch_k: int = 10
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        dense = self.vector_retriever.invoke(query)
+        sparse = [doc for doc, _ in self.bm25.search(query, self.fetch_k)]
+        return reciprocal_rank_fusion([dense, sparse], self.k, self.rrf_k)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        dense_task = asyncio.create_task(self.vector_retriever.ainvoke(query))
+        sparse = [doc for doc, _ in self.bm25.search(query, self.fetch_k)]
+        dense = await dense_task
+        return reciprocal_rank_fusion([dense, sparse], self.k, self.rrf_k)
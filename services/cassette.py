@@ -0,0 +1,337 @@
+from langchain_openai import ChatOpenAI
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    message_to_dict,
+    messages_from_dict
+)
+from langchain_core.messages.tool import tool_call_chunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from typing import Any
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import numpy as np
+from services.log import get_logger
+from config.config import CASSETTE_MODE, CASSETTE_PATH, CASSETTE_LATENCY
+
+logger = get_logger(__name__)
+
+
+class CassetteMissError(LookupError):
+    """重播模式下卡帶中沒有對應的請求"""
+
+
+def serialize(value):
+    """請求中無法直接轉為 JSON 的值，結構化輸出的 pydantic 類別以其 JSON schema 表示"""
+    if hasattr(value, "model_json_schema"):
+        return value.model_json_schema()
+    return str(value)
+
+
+def request_key(kind: str, request) -> str:
+    """以請求類型與內容計算卡帶鍵"""
+    content = json.dumps(request, ensure_ascii=False, sort_keys=True, default=serialize)
+    return hashlib.sha256(f"{kind}\x00{content}".encode("utf-8")).hexdigest()[:32]
+
+
+def encode_vector(vector) -> str:
+    """向量以 float32 位元組的 base64 儲存，比 JSON 浮點數清單精簡"""
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def decode_vector(data: str):
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32).tolist()
+
+
+class Cassette:
+    """錄製與重播 LLM、embedding 與網路搜尋的請求和回應
+
+    卡帶為每行一筆 JSON（{"key", "kind", "latency", "response"}）的檔案，副檔名為 .gz 時以 gzip 壓縮。
+    相同請求可錄到多個回應（例如重新生成），重播時依序回傳，用完後重複最後一個。
+    latency 為 recorded 時重播依錄製時的耗時等待，zero 時立即回傳。
+    """
+
+    def __init__(self, path: str, mode: str = "replay", latency: str = "recorded"):
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.entries = {}
+        self.stats = {"recorded": 0, "replayed": 0, "missed": 0}
+        self._positions = {}
+        self._file = None
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._load()
+
+    def _open(self, mode):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load(self):
+        with self._open("r") as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries.setdefault(entry["key"], []).append(
+                        (entry["response"], entry["latency"]))
+        logger.info("cassette loaded", extra={"path": self.path, "requests": len(self.entries)})
+
+    def lookup(self, kind: str, request):
+        """回傳錄製的 (回應, 耗時)，找不到時拋出 CassetteMissError"""
+        key = request_key(kind, request)
+        with self._lock:
+            responses = self.entries.get(key)
+            if not responses:
+                self.stats["missed"] += 1
+                raise CassetteMissError(f"卡帶中沒有 {kind} 請求 {key}")
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            self.stats["replayed"] += 1
+            return responses[min(position, len(responses) - 1)]
+
+    def record(self, kind: str, request, response, latency: float):
+        """附加一筆錄製結果，每筆立即寫入避免中斷時遺失"""
+        key = request_key(kind, request)
+        line = json.dumps({"key": key, "kind": kind, "latency": round(latency, 4),
+                           "response": response}, ensure_ascii=False, default=serialize)
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = self._open("a")
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.entries.setdefault(key, []).append((response, latency))
+            self.stats["recorded"] += 1
+
+    def delay(self, latency: float):
+        """重播時應等待的秒數"""
+        return latency if self.latency == "recorded" else 0.0
+
+    def call(self, kind: str, request, func, encode=None, decode=None):
+        """錄製模式呼叫 func 並記錄結果，重播模式回傳錄製的結果"""
+        if self.mode == "replay":
+            response, latency = self.lookup(kind, request)
+            time.sleep(self.delay(latency))
+            return decode(response) if decode else response
+        start = time.perf_counter()
+        result = func()
+        self.record(kind, request, encode(result) if encode else result, time.perf_counter() - start)
+        return result
+
+    async def acall(self, kind: str, request, func, encode=None, decode=None):
+        """call 的非同步版本，func 回傳 awaitable"""
+        if self.mode == "replay":
+            response, latency = self.lookup(kind, request)
+            await asyncio.sleep(self.delay(latency))
+            return decode(response) if decode else response
+        start = time.perf_counter()
+        result = await func()
+        self.record(kind, request, encode(result) if encode else result, time.perf_counter() - start)
+        return result
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def report(self):
+        """輸出錄製與重播統計"""
+        logger.info("cassette", extra={"mode": self.mode, "path": self.path, **self.stats})
+
+
+def encode_result(result: ChatResult):
+    return {
+        "generations": [
+            {"message": message_to_dict(g.message), "generation_info": g.generation_info}
+            for g in result.generations
+        ],
+        "llm_output": result.llm_output,
+    }
+
+
+def decode_result(data, schema=None) -> ChatResult:
+    """還原錄製的 ChatResult，結構化輸出的 parsed 欄位依 schema 轉回 pydantic 物件"""
+    messages = messages_from_dict([g["message"] for g in data["generations"]])
+    for message in messages:
+        parsed = message.additional_kwargs.get("parsed")
+        if isinstance(parsed, dict) and hasattr(schema, "model_validate"):
+            message.additional_kwargs["parsed"] = schema.model_validate(parsed)
+    return ChatResult(
+        generations=[
+            ChatGeneration(message=to_message(message), generation_info=g["generation_info"])
+            for message, g in zip(messages, data["generations"])
+        ],
+        llm_output=data["llm_output"],
+    )
+
+
+def to_message(message) -> AIMessage:
+    """串流錄製的 AIMessageChunk 轉為 AIMessage"""
+    if isinstance(message, AIMessageChunk):
+        return AIMessage(
+            content=message.content,
+            additional_kwargs=message.additional_kwargs,
+            response_metadata=message.response_metadata,
+            tool_calls=message.tool_calls,
+            usage_metadata=message.usage_metadata,
+            id=message.id,
+        )
+    return message
+
+
+def to_chunk(message: AIMessage) -> AIMessageChunk:
+    """重播串流時將錄製的回應轉為單一 chunk"""
+    return AIMessageChunk(
+        content=message.content,
+        additional_kwargs=message.additional_kwargs,
+        response_metadata=message.response_metadata,
+        tool_call_chunks=[
+            tool_call_chunk(name=call["name"], args=json.dumps(call["args"], ensure_ascii=False),
+                            id=call["id"], index=i)
+            for i, call in enumerate(message.tool_calls)
+        ],
+        usage_metadata=message.usage_metadata,
+        id=message.id,
+    )
+
+
+class CassetteChatOpenAI(ChatOpenAI):
+    """經由卡帶錄製或重播的 ChatOpenAI，bind_tools 與 with_structured_output 產生的參數也列入請求鍵"""
+
+    cassette: Any = None
+
+    def _request(self, messages, stop, kwargs):
+        return {
+            "model": self.model_name,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "messages": [message_to_dict(m) for m in messages],
+            "stop": stop,
+            "kwargs": kwargs,
+        }
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return self.cassette.call(
+            "llm", self._request(messages, stop, kwargs),
+            lambda: super(CassetteChatOpenAI, self)._generate(
+                messages, stop=stop, run_manager=run_manager, **kwargs),
+            encode=encode_result,
+            decode=lambda data: decode_result(data, kwargs.get("response_format")))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        return await self.cassette.acall(
+            "llm", self._request(messages, stop, kwargs),
+            lambda: super(CassetteChatOpenAI, self)._agenerate(
+                messages, stop=stop, run_manager=run_manager, **kwargs),
+            encode=encode_result,
+            decode=lambda data: decode_result(data, kwargs.get("response_format")))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        request = self._request(messages, stop, kwargs)
+        if self.cassette.mode == "replay":
+            response, latency = self.cassette.lookup("llm", request)
+            result = decode_result(response, kwargs.get("response_format"))
+            await asyncio.sleep(self.cassette.delay(latency))
+            chunk = ChatGenerationChunk(message=to_chunk(result.generations[0].message))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            return
+
+        # 錄製時照常串流，結束後以合併的訊息記錄
+        start = time.perf_counter()
+        merged = None
+        async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            merged = chunk if merged is None else merged + chunk
+            yield chunk
+        if merged is not None:
+            result = ChatResult(generations=[ChatGeneration(message=to_message(merged.message))])
+            self.cassette.record("llm", request, encode_result(result), time.perf_counter() - start)
+
+
+class CassetteEmbeddings(Embeddings):
+    """經由卡帶錄製或重播的 embeddings，以 (模型名稱, 用途, 文字) 為請求鍵
+
+    批次請求的耗時平均分配給每段文字，重播時等待各段文字耗時的總和。
+    """
+
+    def __init__(self, embeddings, model_name, cassette):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cassette = cassette
+
+    def _request(self, kind, text):
+        return {"model": self.model_name, "kind": kind, "text": text}
+
+    def _replay(self, kind, texts):
+        results = [self.cassette.lookup("embedding", self._request(kind, t)) for t in texts]
+        return [decode_vector(r) for r, _ in results], sum(self.cassette.delay(l) for _, l in results)
+
+    def _record(self, kind, texts, vectors, elapsed):
+        for text, vector in zip(texts, vectors):
+            self.cassette.record("embedding", self._request(kind, text),
+                                 encode_vector(vector), elapsed / len(texts))
+
+    def embed_documents(self, texts):
+        if self.cassette.mode == "replay":
+            vectors, latency = self._replay("document", texts)
+            time.sleep(latency)
+            return vectors
+        start = time.perf_counter()
+        vectors = self.embeddings.embed_documents(texts)
+        self._record("document", texts, vectors, time.perf_counter() - start)
+        return vectors
+
+    async def aembed_documents(self, texts):
+        if self.cassette.mode == "replay":
+            vectors, latency = self._replay("document", texts)
+            await asyncio.sleep(latency)
+            return vectors
+        start = time.perf_counter()
+        vectors = await self.embeddings.aembed_documents(texts)
+        self._record("document", texts, vectors, time.perf_counter() - start)
+        return vectors
+
+    def embed_query(self, text):
+        if self.cassette.mode == "replay":
+            vectors, latency = self._replay("query", [text])
+            time.sleep(latency)
+            return vectors[0]
+        start = time.perf_counter()
+        vector = self.embeddings.embed_query(text)
+        self._record("query", [text], [vector], time.perf_counter() - start)
+        return vector
+
+    async def aembed_query(self, text):
+        if self.cassette.mode == "replay":
+            vectors, latency = self._replay("query", [text])
+            await asyncio.sleep(latency)
+            return vectors[0]
+        start = time.perf_counter()
+        vector = await self.embeddings.aembed_query(text)
+        self._record("query", [text], [vector], time.perf_counter() - start)
+        return vector
+
+
+_cassette = None
+
+
+def get_cassette():
+    """取得行程內共用的卡帶，CASSETTE_MODE 為 off 時回傳 None"""
+    global _cassette
+    if CASSETTE_MODE == "off":
+        return None
+    if _cassette is None:
+        _cassette = Cassette(CASSETTE_PATH, mode=CASSETTE_MODE, latency=CASSETTE_LATENCY)
+    return _cassette
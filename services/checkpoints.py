@@ -0,0 +1,221 @@
+from langgraph.checkpoint.memory import InMemorySaver
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+import asyncio
+from services.log import get_logger
+from config.config import (
+    CHECKPOINT_FLUSH_INTERVAL,
+    CHECKPOINT_RETENTION_HOURS,
+    CHECKPOINT_PRUNE_INTERVAL,
+    CHECKPOINT_PRUNE_BATCH
+)
+
+logger = get_logger(__name__)
+
+
+class WriteBehindSaver(InMemorySaver):
+    """在記憶體中保存 checkpoint，背景定期將每個 thread 最新的 checkpoint 寫入 target
+
+    同一 thread 在兩次寫入之間的多個 checkpoint 只寫入最新的一個；寫入後未再更新的 thread 自記憶體移除，
+    記憶體中找不到的 thread 改由 target 讀取。行程異常終止時尚未寫入的 checkpoint 會遺失。
+    """
+
+    def __init__(self, target, flush_interval: float = 1.0):
+        super().__init__(serde=target.serde)
+        self.target = target
+        self.flush_interval = flush_interval
+        self.stats = {"checkpoints": 0, "flushed": 0, "failed": 0}
+        self._dirty = {}
+        self._task = None
+
+    def get_next_version(self, current, channel):
+        # 與 target 使用相同的版本格式，自 target 載入的 thread 可繼續寫入
+        return self.target.get_next_version(current, channel)
+
+    async def aget_tuple(self, config):
+        found = self.get_tuple(config)
+        if found is None:
+            return await self.target.aget_tuple(config)
+        return found
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        thread_id = (config or {}).get("configurable", {}).get("thread_id")
+        if thread_id is not None and thread_id not in self.storage:
+            async for item in self.target.alist(config, filter=filter, before=before, limit=limit):
+                yield item
+            return
+        for item in self.list(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        next_config = self.put(config, checkpoint, metadata, new_versions)
+        self.stats["checkpoints"] += 1
+        self._dirty[next_config["configurable"]["thread_id"]] = next_config
+        self.start()
+        return next_config
+
+    async def adelete_thread(self, thread_id):
+        self._dirty.pop(thread_id, None)
+        self.delete_thread(thread_id)
+        await self.target.adelete_thread(thread_id)
+
+    def start(self):
+        """啟動背景寫入 task"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """將每個有變更的 thread 最新的 checkpoint 與其待處理寫入寫入 target"""
+        dirty, self._dirty = self._dirty, {}
+        for thread_id, config in dirty.items():
+            saved = self.get_tuple(config)
+            if saved is None:
+                continue
+            try:
+                parent = saved.parent_config or {"configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": saved.config["configurable"]["checkpoint_ns"],
+                }}
+                # 只寫入最新的 checkpoint，所有 channel 的值都需一併寫入
+                await self.target.aput(
+                    parent, saved.checkpoint, saved.metadata, saved.checkpoint["channel_versions"])
+                writes = defaultdict(list)
+                for task_id, channel, value in saved.pending_writes or []:
+                    writes[task_id].append((channel, value))
+                for task_id, task_writes in writes.items():
+                    await self.target.aput_writes(saved.config, task_writes, task_id)
+                self.stats["flushed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.exception(f"寫入 checkpoint 時發生錯誤: {str(e)}", extra={"thread_id": thread_id})
+                continue
+            if thread_id not in self._dirty:
+                self.delete_thread(thread_id)
+
+    async def close(self):
+        """停止背景 task 並寫入剩餘的 checkpoint"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        logger.info("write-behind checkpointer", extra=self.stats)
+
+
+class CheckpointPruner:
+    """定期刪除最後一個 checkpoint 早於保存時數的 thread
+
+    以 checkpoint 的 ts 欄位建立索引，每次最多刪除 batch 個 thread，直到沒有過期的 thread。
+    """
+
+    def __init__(self, get_pool, retention_hours: float = 24, interval: float = 3600,
+                 batch: int = 500):
+        self.get_pool = get_pool
+        self.retention_hours = retention_hours
+        self.interval = interval
+        self.batch = batch
+        self._task = None
+
+    async def setup(self):
+        """啟動背景 task，checkpoint 表格需已由 checkpointer 建立"""
+        if not self.retention_hours:
+            return
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def create_index(self):
+        """以 CONCURRENTLY 建立 ts 索引，不阻擋 checkpoint 寫入；連線池需為 autocommit
+
+        建立中斷會留下無效的索引，IF NOT EXISTS 不會重建，因此先刪除無效的索引。
+        """
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            cur = await conn.execute("""
+                SELECT i.indisvalid FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = 'checkpoints_ts_idx'
+            """)
+            row = await cur.fetchone()
+            if row is not None and row[0]:
+                return
+            if row is not None:
+                await conn.execute("DROP INDEX CONCURRENTLY IF EXISTS checkpoints_ts_idx")
+            await conn.execute("""
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS checkpoints_ts_idx
+                ON checkpoints ((checkpoint->>'ts'))
+            """)
+        logger.info("checkpoint ts 索引建立完成")
+
+    async def _run(self):
+        # 建立索引需等待進行中的交易結束，在背景進行以免延遲啟動
+        try:
+            await self.create_index()
+        except Exception as e:
+            logger.exception(f"建立 checkpoint 索引時發生錯誤: {str(e)}")
+        while True:
+            try:
+                await self.prune()
+            except Exception as e:
+                logger.exception(f"刪除過期 checkpoint 時發生錯誤: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def prune(self):
+        """刪除過期的 thread，回傳刪除的 thread 數"""
+        # checkpoint 的 ts 為 UTC ISO 8601 字串，可直接以字串比較
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=self.retention_hours)).isoformat()
+        pool = await self.get_pool()
+        deleted = 0
+        while True:
+            async with pool.connection() as conn:
+                cur = await conn.execute("""
+                    SELECT DISTINCT thread_id FROM checkpoints
+                    WHERE checkpoint->>'ts' < %s
+                      AND thread_id NOT IN (
+                          SELECT thread_id FROM checkpoints WHERE checkpoint->>'ts' >= %s
+                      )
+                    LIMIT %s
+                """, (cutoff, cutoff, self.batch))
+                threads = [row[0] for row in await cur.fetchall()]
+                if threads:
+                    async with conn.transaction():
+                        for table in ("checkpoint_writes", "checkpoint_blobs", "checkpoints"):
+                            await conn.execute(
+                                f"DELETE FROM {table} WHERE thread_id = ANY(%s)", (threads,))
+            deleted += len(threads)
+            if len(threads) < self.batch:
+                break
+        if deleted:
+            logger.info("刪除過期 checkpoint", extra={"threads": deleted})
+        return deleted
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def create_write_behind_saver(target):
+    """依設定建立寫回式 checkpointer"""
+    return WriteBehindSaver(target, flush_interval=CHECKPOINT_FLUSH_INTERVAL)
+
+
+def create_checkpoint_pruner(get_pool):
+    """依設定建立過期 checkpoint 清除工作"""
+    return CheckpointPruner(
+        get_pool,
+        retention_hours=CHECKPOINT_RETENTION_HOURS,
+        interval=CHECKPOINT_PRUNE_INTERVAL,
+        batch=CHECKPOINT_PRUNE_BATCH,
+    )
@@ -0,0 +1,104 @@
+import os
+import tiktoken
+from services.log import get_logger
+from config.config import LLM_MODEL, CONTEXT_MAX_TOKENS, CHUNK_OVERLAP
+
+logger = get_logger(__name__)
+
+# 重疊少於此字數時視為巧合，不予裁切
+MIN_OVERLAP = 20
+# 超出預算時，剩餘額度少於此 token 數就不再截斷放入
+MIN_TRUNCATED_TOKENS = 50
+
+_encoding = None
+
+
+class CharEncoding:
+    """無法載入 tiktoken 詞表時（例如離線環境）以字元數保守估計 token 數"""
+
+    def encode(self, text):
+        return list(text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+def get_encoding():
+    """取得與生成模型相符的本地 tokenizer"""
+    global _encoding
+    if _encoding is None:
+        try:
+            try:
+                _encoding = tiktoken.encoding_for_model(LLM_MODEL)
+            except KeyError:
+                _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.warning(f"載入 tokenizer 失敗，改以字元數估計: {str(e)}")
+            _encoding = CharEncoding()
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """計算文字的 token 數"""
+    return len(get_encoding().encode(text))
+
+
+def source_tag(document) -> str:
+    """產生精簡的來源標記，例如 motorcycle_safety_02.pdf p.3"""
+    source = document.metadata.get("source")
+    if not source:
+        return "unknown"
+    if source.startswith("http"):
+        return source
+    page = document.metadata.get("page")
+    name = os.path.basename(source)
+    return f"{name} p.{page + 1}" if isinstance(page, int) else name
+
+
+def trim_overlap(kept: str, text: str) -> str:
+    """移除 text 與已保留區塊首尾重疊的部分"""
+    limit = min(len(kept), len(text), CHUNK_OVERLAP * 2)
+    for size in range(limit, MIN_OVERLAP - 1, -1):
+        if kept.endswith(text[:size]):
+            return text[size:]
+        if kept.startswith(text[-size:]):
+            return text[:-size]
+    return text
+
+
+def dedupe_chunks(documents):
+    """依序去除重複或與已保留區塊重疊的內容，回傳 (文件, 剩餘內容)"""
+    kept = []
+    for document in documents:
+        text = document.page_content.strip()
+        source = document.metadata.get("source")
+        for other, other_text in kept:
+            if other.metadata.get("source") != source:
+                continue
+            if text in other.page_content:
+                text = ""
+                break
+            text = trim_overlap(other.page_content, text).strip()
+        if text:
+            kept.append((document, text))
+    return kept
+
+
+def pack_context(documents, max_tokens: int = CONTEXT_MAX_TOKENS) -> str:
+    """將文件組成提示內容：只保留內文與來源標記，去除重疊並裁切至 token 預算
+
+    文件順序即相關性排序（檢索排名在前，網路搜尋結果在後），超出預算時捨棄排名較後者。
+    """
+    encoding = get_encoding()
+    sections = []
+    remaining = max_tokens
+    for index, (document, text) in enumerate(dedupe_chunks(documents), start=1):
+        header = f"[{index}] ({source_tag(document)})\n"
+        tokens = encoding.encode(header + text)
+        if len(tokens) > remaining:
+            if remaining >= MIN_TRUNCATED_TOKENS:
+                sections.append(encoding.decode(tokens[:remaining]).rstrip("\ufffd"))
+            break
+        sections.append(header + text)
+        remaining -= len(tokens)
+    return "\n\n".join(sections)
@@ -0,0 +1,191 @@
+from langchain_core.embeddings import Embeddings
+from services.metrics import EMBEDDING_LATENCY, EMBEDDING_TEXTS, EMBEDDING_RETRIES
+from services.log import get_logger
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import random
+import threading
+import time
+
+logger = get_logger(__name__)
+
+
+class TokenBucket:
+    """每分鐘配額的令牌桶，不足時預約並回傳需等待的秒數"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            amount = min(amount, self.capacity)
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+def is_rate_limit_error(error):
+    """判斷是否為限流或配額錯誤"""
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if status == 429:
+        return True
+    message = f"{type(error).__name__} {error}".lower()
+    return any(marker in message for marker in (
+        "429", "resourceexhausted", "resource exhausted", "rate limit", "quota", "too many requests"))
+
+
+def estimate_tokens(text):
+    """粗估 token 數，中文約一字一 token"""
+    return max(1, len(text))
+
+
+class EmbeddingScheduler(Embeddings):
+    """將區塊分批、在每分鐘請求數與 token 數預算內並行嵌入，遇限流時退避重試
+
+    同步方法呼叫底層模型的同步方法，以執行緒池限制並行數；不為每次呼叫建立事件迴圈，
+    因為底層模型的非同步 HTTP 連線綁定在第一次使用的事件迴圈上。
+    """
+
+    def __init__(self, embeddings, batch_size=100, max_concurrency=4,
+                 requests_per_minute=0, tokens_per_minute=0,
+                 max_retries=5, backoff_base=1.0, backoff_max=30.0):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stats = {"texts": 0, "batches": 0, "retries": 0, "throttled_seconds": 0.0,
+                      "seconds": 0.0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key, amount=1):
+        """更新統計，同步呼叫時可能來自多個執行緒"""
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _reserve(self, texts):
+        """預約每分鐘請求數與 token 數預算，回傳需等待的秒數"""
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens:
+            wait = max(wait, self.tokens.reserve(sum(estimate_tokens(t) for t in texts)))
+        if wait > 0:
+            self._count("throttled_seconds", wait)
+        return wait
+
+    def _backoff(self, attempt, error):
+        """回傳限流錯誤的重試等待秒數，不可重試時拋出原錯誤"""
+        if attempt == self.max_retries or not is_rate_limit_error(error):
+            raise error
+        self._count("retries")
+        EMBEDDING_RETRIES.inc()
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        logger.warning("embedding rate limited, retry", extra={
+            "attempt": attempt + 1, "delay": round(delay, 2)})
+        return delay * random.uniform(0.5, 1.0)
+
+    def _observe(self, kind, texts, start):
+        EMBEDDING_LATENCY.labels(kind).observe(time.perf_counter() - start)
+        EMBEDDING_TEXTS.labels(kind).inc(len(texts))
+
+    async def _call(self, func, texts, kind="documents"):
+        """呼叫遠端 embedding，遇限流錯誤時指數退避重試"""
+        for attempt in range(self.max_retries + 1):
+            wait = self._reserve(texts)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            start = time.perf_counter()
+            try:
+                result = await func()
+            except Exception as e:
+                await asyncio.sleep(self._backoff(attempt, e))
+                continue
+            self._observe(kind, texts, start)
+            return result
+
+    def _call_sync(self, func, texts, kind="documents"):
+        """_call 的同步版本，在呼叫端執行緒中等待"""
+        for attempt in range(self.max_retries + 1):
+            wait = self._reserve(texts)
+            if wait > 0:
+                time.sleep(wait)
+            start = time.perf_counter()
+            try:
+                result = func()
+            except Exception as e:
+                time.sleep(self._backoff(attempt, e))
+                continue
+            self._observe(kind, texts, start)
+            return result
+
+    def _batches(self, texts):
+        return [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+    def _finish(self, texts, batches, start):
+        self._count("texts", len(texts))
+        self._count("batches", len(batches))
+        self._count("seconds", time.perf_counter() - start)
+
+    async def aembed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        batches = self._batches(texts)
+
+        async def embed_batch(batch):
+            async with semaphore:
+                return await self._call(
+                    lambda: self.embeddings.aembed_documents(batch), batch)
+
+        results = await asyncio.gather(*(embed_batch(b) for b in batches))
+        self._finish(texts, batches, start)
+        return [vector for batch in results for vector in batch]
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        start = time.perf_counter()
+        batches = self._batches(texts)
+
+        def embed_batch(batch):
+            return self._call_sync(lambda: self.embeddings.embed_documents(batch), batch)
+
+        if len(batches) == 1 or self.max_concurrency <= 1:
+            results = [embed_batch(b) for b in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                results = list(executor.map(embed_batch, batches))
+        self._finish(texts, batches, start)
+        return [vector for batch in results for vector in batch]
+
+    async def aembed_query(self, text):
+        return await self._call(lambda: self.embeddings.aembed_query(text), [text], "query")
+
+    def embed_query(self, text):
+        return self._call_sync(lambda: self.embeddings.embed_query(text), [text], "query")
+
+    def throughput(self):
+        """回傳平均每秒嵌入的區塊數"""
+        seconds = self.stats["seconds"]
+        return self.stats["texts"] / seconds if seconds else 0.0
+
+    def report(self):
+        """輸出嵌入吞吐量統計"""
+        logger.info("embedding throughput", extra={
+            "texts": self.stats["texts"], "batches": self.stats["batches"],
+            "retries": self.stats["retries"], "texts_per_second": round(self.throughput(), 1)})
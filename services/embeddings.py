@@ -1,18 +1,196 @@
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_chroma import Chroma
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.storage import LocalFileStore
+from langchain_core.embeddings import Embeddings
+from services.numpy_store import NumpyVectorStore
+from services.embedding_scheduler import EmbeddingScheduler
+from services.cassette import CassetteEmbeddings, get_cassette
+from services.metrics import CACHE_LOOKUPS
+from config.config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_CONCURRENCY,
+    EMBEDDING_REQUESTS_PER_MINUTE,
+    EMBEDDING_TOKENS_PER_MINUTE,
+    EMBEDDING_MAX_RETRIES,
+    VECTOR_BACKEND,
+    CHUNK_SIZE,
+    CHUNK_OVERLAP
+)
+import hashlib
+import json
+
+COLLECTION_NAME = "motorcycle_safety"
+
+# 行程內共用的 embeddings 與批次排程器
+_embeddings = None
+_scheduler = None
+
+
+class CachedEmbeddings(Embeddings):
+    """以 (模型名稱, 用途, 文字) 雜湊為鍵、存於本地磁碟的 embeddings 快取"""
+
+    def __init__(self, embeddings, model_name, cache_dir):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.store = LocalFileStore(cache_dir)
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, kind, text):
+        """文件與查詢向量在部分模型中不同，因此用途也列入鍵值"""
+        content = f"{self.model_name}\x00{kind}\x00{text}".encode("utf-8")
+        return hashlib.sha256(content).hexdigest()
+
+    def _count(self, hits, misses):
+        """更新命中統計"""
+        self.hits += hits
+        self.misses += misses
+        CACHE_LOOKUPS.labels("embedding", "hit").inc(hits)
+        CACHE_LOOKUPS.labels("embedding", "miss").inc(misses)
+
+    def _split(self, keys, cached):
+        """找出未命中的鍵，相同文字只送出一次"""
+        missing = {}
+        for key, value in zip(keys, cached):
+            if value is None:
+                missing.setdefault(key, len(missing))
+        self._count(len(keys) - sum(value is None for value in cached), len(missing))
+        return missing
+
+    def _merge(self, keys, cached, missing, vectors):
+        """合併快取與新計算的向量，保持輸入順序"""
+        computed = {key: vectors[i] for key, i in missing.items()}
+        return [
+            json.loads(value) if value is not None else computed[key]
+            for key, value in zip(keys, cached)
+        ]
+
+    def embed_documents(self, texts):
+        keys = [self._key("document", text) for text in texts]
+        cached = self.store.mget(keys)
+        missing = self._split(keys, cached)
+        vectors = []
+        if missing:
+            texts_by_key = dict(zip(keys, texts))
+            vectors = self.embeddings.embed_documents(
+                [texts_by_key[key] for key in missing])
+            self.store.mset([
+                (key, json.dumps(vectors[i]).encode("utf-8")) for key, i in missing.items()])
+        return self._merge(keys, cached, missing, vectors)
+
+    async def aembed_documents(self, texts):
+        keys = [self._key("document", text) for text in texts]
+        cached = await self.store.amget(keys)
+        missing = self._split(keys, cached)
+        vectors = []
+        if missing:
+            texts_by_key = dict(zip(keys, texts))
+            vectors = await self.embeddings.aembed_documents(
+                [texts_by_key[key] for key in missing])
+            await self.store.amset([
+                (key, json.dumps(vectors[i]).encode("utf-8")) for key, i in missing.items()])
+        return self._merge(keys, cached, missing, vectors)
+
+    def embed_query(self, text):
+        key = self._key("query", text)
+        cached = self.store.mget([key])[0]
+        if cached is not None:
+            self._count(1, 0)
+            return json.loads(cached)
+        self._count(0, 1)
+        vector = self.embeddings.embed_query(text)
+        self.store.mset([(key, json.dumps(vector).encode("utf-8"))])
+        return vector
+
+    async def aembed_query(self, text):
+        key = self._key("query", text)
+        cached = (await self.store.amget([key]))[0]
+        if cached is not None:
+            self._count(1, 0)
+            return json.loads(cached)
+        self._count(0, 1)
+        vector = await self.embeddings.aembed_query(text)
+        await self.store.amset([(key, json.dumps(vector).encode("utf-8"))])
+        return vector
+
+
+def get_embedding_scheduler():
+    """取得共用的 embedding 排程器"""
+    get_embeddings()
+    return _scheduler
+
+
+def create_text_splitter():
+    """建立文件切分器"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
+    )
+
+
+def get_embeddings():
+    """取得行程內共用的 embeddings
+
+    遠端呼叫經由 EmbeddingScheduler 分批與限流，啟用快取時外層再包裝 CachedEmbeddings，
+    只有未命中的文字會進入排程器。啟用卡帶時最外層為 CassetteEmbeddings，重播時不經過快取與排程器。
+    """
+    global _embeddings, _scheduler
+    if _embeddings is None:
+        _scheduler = EmbeddingScheduler(
+            GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL),
+            batch_size=EMBEDDING_BATCH_SIZE,
+            max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+            requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE,
+            tokens_per_minute=EMBEDDING_TOKENS_PER_MINUTE,
+            max_retries=EMBEDDING_MAX_RETRIES,
+        )
+        embeddings = _scheduler
+        if EMBEDDING_CACHE_ENABLED:
+            embeddings = CachedEmbeddings(
+                embeddings, EMBEDDING_MODEL, EMBEDDING_CACHE_DIR)
+        cassette = get_cassette()
+        if cassette:
+            embeddings = CassetteEmbeddings(embeddings, EMBEDDING_MODEL, cassette)
+        _embeddings = embeddings
+    return _embeddings
 
 
 class EmbeddingService:
     def __init__(self):
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/embedding-001")
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
+        self.embeddings = get_embeddings()
+        self.text_splitter = create_text_splitter()
+
+    def split_documents(self, documents):
+        """將文件切分為檢索用的區塊"""
+        return self.text_splitter.split_documents(documents)
+
+    def create_vectorstore(self, documents, persist_directory=None, split=True):
+        """建立向量資料庫，指定 persist_directory 時寫入磁碟"""
+        docs = self.split_documents(documents) if split else documents
+        if VECTOR_BACKEND == "numpy":
+            return NumpyVectorStore.from_documents(
+                documents=docs,
+                embedding=self.embeddings,
+                persist_directory=persist_directory,
+            )
+        return Chroma.from_documents(
+            documents=docs,
+            embedding=self.embeddings,
+            collection_name=COLLECTION_NAME,
+            persist_directory=persist_directory,
         )
 
-    def create_vectorstore(self, documents):
-        """建立向量資料庫"""
-        docs = self.text_splitter.split_documents(documents)
-        return Chroma.from_documents(documents=docs, embedding=self.embeddings)
+    def load_vectorstore(self, persist_directory):
+        """載入已建立的向量資料庫"""
+        if VECTOR_BACKEND == "numpy":
+            return NumpyVectorStore(
+                self.embeddings, persist_directory=persist_directory)
+        return Chroma(
+            collection_name=COLLECTION_NAME,
+            embedding_function=self.embeddings,
+            persist_directory=persist_directory,
+        )
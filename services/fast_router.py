@@ -0,0 +1,176 @@
+import asyncio
+import random
+import numpy as np
+from services.embeddings import get_embeddings
+from services.numpy_store import normalize_rows
+from services.metrics import FAST_ROUTES, FAST_ROUTE_AUDITS
+from services.log import get_logger
+from config.config import FAST_ROUTER_MARGIN, FAST_ROUTER_AUDIT_RATE
+
+logger = get_logger(__name__)
+
+# 抽樣比對次數達此倍數時輸出統計
+AUDIT_REPORT_INTERVAL = 100
+
+# 各路由的主題範例問題，每個主題的向量平均為一個中心點。
+# vectorstore 主題與問題路由提示中的向量資料庫範疇一致；
+# web_search 另含機車產品與保養等相近但非法規的問題，以拉開兩者差距。
+ROUTE_EXEMPLARS = {
+    "vectorstore": {
+        "駕照規定": [
+            "大型重型機車駕照需要什麼資格？",
+            "幾歲可以考大型重型機車駕照？",
+            "持有普通重型機車駕照多久才能考大型重機？",
+            "大型重型機車駕照的有效期限是多久？",
+            "無照駕駛大型重型機車會被怎麼處罰？",
+        ],
+        "考照要求": [
+            "大型重型機車考照要考哪些項目？",
+            "大型重機路考的內容有哪些？",
+            "考大型重型機車駕照一定要上駕訓班嗎？",
+            "大型重機筆試的題目範圍是什麼？",
+            "報考大型重型機車駕照需要準備哪些文件？",
+        ],
+        "路權規範": [
+            "大型重型機車可以行駛高速公路嗎？",
+            "大型重機可以走快車道嗎？",
+            "大型重型機車需要兩段式左轉嗎？",
+            "大型重機可以行駛機車專用道嗎？",
+            "大型重型機車在路口的路權如何規定？",
+        ],
+        "標線標誌規定": [
+            "禁止機車行駛的標誌長什麼樣子？",
+            "雙黃線可以跨越超車嗎？",
+            "機車待轉區標線代表什麼意思？",
+            "白色實線可以變換車道嗎？",
+            "路面上的慢車道標線是什麼意思？",
+        ],
+        "道路安全法規": [
+            "大型重機在高速公路上的速限是多少？",
+            "騎大型重型機車需要戴什麼樣的安全帽？",
+            "大型重機在高速公路上可以載人嗎？",
+            "騎乘大型重機應保持多少行車安全距離？",
+            "大型重型機車違規超速會有什麼罰則？",
+        ],
+    },
+    "web_search": {
+        "時事與一般知識": [
+            "今天台北的天氣如何？",
+            "台積電今天的股價是多少？",
+            "推薦台北好吃的牛肉麵",
+            "最近有什麼重要新聞？",
+            "日本自由行有什麼推薦行程？",
+        ],
+        "機車產品與保養": [
+            "哪一款重機最適合新手？",
+            "重機多久需要保養一次？",
+            "今年有哪些新款重機上市？",
+            "重機輪胎要怎麼挑選？",
+            "推薦好用的機車藍牙耳機",
+        ],
+    },
+}
+
+
+class FastRouter:
+    """以問題向量與主題中心點的相似度決定路由，差距不足時交由 LLM 路由
+
+    margin 為 vectorstore 與 web_search 最高相似度的差距門檻；
+    audit_rate 為快速路徑決定後在背景以 LLM 路由抽樣比對的比例。
+    """
+
+    def __init__(self, exemplars=None, margin: float = 0.05, audit_rate: float = 0.1):
+        self.exemplars = exemplars or ROUTE_EXEMPLARS
+        self.margin = margin
+        self.audit_rate = audit_rate
+        self.embeddings = None
+        self.routes = []
+        self.centroids = None
+        self.stats = {"total": 0, "fast": 0, "ambiguous": 0, "audited": 0, "agreed": 0}
+        self._audits = set()
+        self._setup_lock = asyncio.Lock()
+
+    async def setup(self):
+        """計算各主題的中心點，範例向量經由 embedding 快取只需計算一次
+
+        範例以與 route 相同的查詢用途嵌入，相似度門檻才與實際問題一致。
+        """
+        async with self._setup_lock:
+            if self.centroids is not None:
+                return
+            self.embeddings = get_embeddings()
+            routes = []
+            centroids = []
+            for route, topics in self.exemplars.items():
+                for questions in topics.values():
+                    vectors = normalize_rows(np.asarray(await asyncio.gather(
+                        *(self.embeddings.aembed_query(q) for q in questions)), dtype=np.float32))
+                    routes.append(route)
+                    centroids.append(vectors.mean(axis=0))
+            self.routes = routes
+            self.centroids = normalize_rows(np.vstack(centroids))
+
+    async def route(self, question: str):
+        """回傳 'vectorstore' 或 'web_search'，落在模糊區間時回傳 None"""
+        if self.centroids is None:
+            await self.setup()
+        embedding = await self.embeddings.aembed_query(question)
+        scores = self.centroids @ normalize_rows(np.asarray(embedding, dtype=np.float32))[0]
+
+        best = {}
+        for route, score in zip(self.routes, scores):
+            best[route] = max(best.get(route, -1.0), float(score))
+        diff = best["vectorstore"] - best["web_search"]
+
+        self.stats["total"] += 1
+        if abs(diff) < self.margin:
+            self.stats["ambiguous"] += 1
+            FAST_ROUTES.labels("ambiguous").inc()
+            logger.debug("fast route ambiguous, fallback to llm router", extra={"gap": round(diff, 3)})
+            return None
+        self.stats["fast"] += 1
+        route = "vectorstore" if diff > 0 else "web_search"
+        FAST_ROUTES.labels(route).inc()
+        logger.debug("fast route", extra={"route": route, "gap": round(diff, 3)})
+        return route
+
+    def should_audit(self):
+        """抽樣決定是否以 LLM 路由比對快速路徑的結果"""
+        return random.random() < self.audit_rate
+
+    def start_audit(self, route, llm_route):
+        """在背景等待 LLM 路由結果並記錄是否一致，不延遲目前的請求"""
+        async def audit():
+            try:
+                expected = await llm_route
+            except Exception as e:
+                logger.warning(f"路由抽樣比對失敗: {str(e)}")
+                return
+            self.stats["audited"] += 1
+            self.stats["agreed"] += int(expected == route)
+            FAST_ROUTE_AUDITS.labels("agree" if expected == route else "disagree").inc()
+            logger.debug("fast route audit", extra={"route": route, "llm_route": expected})
+            # 每 AUDIT_REPORT_INTERVAL 次比對輸出一次統計
+            if self.stats["audited"] % AUDIT_REPORT_INTERVAL == 0:
+                self.report()
+
+        task = asyncio.create_task(audit())
+        self._audits.add(task)
+        task.add_done_callback(self._audits.discard)
+
+    def fast_rate(self):
+        """快速路徑所占比例"""
+        return self.stats["fast"] / self.stats["total"] if self.stats["total"] else 0.0
+
+    def agreement_rate(self):
+        """抽樣比對中與 LLM 路由一致的比例"""
+        return self.stats["agreed"] / self.stats["audited"] if self.stats["audited"] else 0.0
+
+    def report(self):
+        """輸出快速路由統計"""
+        logger.info("fast router", extra={
+            **self.stats, "fast_rate": round(self.fast_rate(), 3),
+            "agreement_rate": round(self.agreement_rate(), 3)})
+
+
+fast_router = FastRouter(margin=FAST_ROUTER_MARGIN, audit_rate=FAST_ROUTER_AUDIT_RATE)
@@ -0,0 +1,256 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+import asyncio
+import json
+import time
+from services.metrics import CACHE_LOOKUPS
+from services.log import get_logger
+from config.config import (
+    HISTORY_RETENTION,
+    HISTORY_MAX_AGE_DAYS,
+    HISTORY_BATCH_SIZE,
+    HISTORY_FLUSH_INTERVAL,
+    HISTORY_QUEUE_SIZE,
+    HISTORY_PRUNE_INTERVAL,
+    HISTORY_CACHE_TTL,
+    HISTORY_CACHE_MAX_SESSIONS
+)
+
+logger = get_logger(__name__)
+
+DEFAULT_SESSION = "default"
+
+# 佇列結束標記
+_STOP = object()
+
+
+class HistoryStore:
+    """依 session 區分的對話歷史，寫入經由背景佇列批次寫入 Postgres
+
+    每個 session 只保留最新 retention 筆，超過 max_age_days 的記錄定期刪除，兩者皆使用索引。
+    讀取由行程內快取回應，寫入時同步更新快取；尚未寫入資料庫的記錄也會出現在讀取結果中。
+    快取 TTL 限制多個 worker 之間的延遲。
+    """
+
+    def __init__(self, get_pool, retention=3, max_age_days=30, batch_size=100,
+                 flush_interval=0.5, queue_size=10000, prune_interval=3600,
+                 cache_ttl=60, cache_max_sessions=1000):
+        self.get_pool = get_pool
+        self.retention = retention
+        self.max_age_days = max_age_days
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.prune_interval = prune_interval
+        self.cache_ttl = cache_ttl
+        self.cache_max_sessions = cache_max_sessions
+        self.stats = {"queued": 0, "written": 0, "dropped": 0, "batches": 0}
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._task = None
+        self._pruned_at = None
+
+    async def setup(self):
+        """建立表格與索引，舊表格補上 session_id 欄位"""
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    CREATE TABLE IF NOT EXISTS conversation_history (
+                        conversation_id TEXT PRIMARY KEY,
+                        session_id TEXT NOT NULL DEFAULT 'default',
+                        state JSONB,
+                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                await cur.execute("""
+                    ALTER TABLE conversation_history
+                    ADD COLUMN IF NOT EXISTS session_id TEXT NOT NULL DEFAULT 'default'
+                """)
+                await cur.execute("""
+                    CREATE INDEX IF NOT EXISTS conversation_history_session_idx
+                    ON conversation_history (session_id, created_at DESC)
+                """)
+                await cur.execute("""
+                    CREATE INDEX IF NOT EXISTS conversation_history_created_idx
+                    ON conversation_history (created_at)
+                """)
+                await conn.commit()
+        self.start()
+
+    def start(self):
+        """啟動背景寫入 task"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """寫入佇列中剩餘的記錄後停止背景 task"""
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        logger.info("history store", extra=self.stats)
+
+    def add(self, session_id: str, conversation_id: str, question: str, answer: str):
+        """加入一筆記錄，不等待資料庫寫入；佇列已滿時捨棄並記錄警告"""
+        self.start()
+        row = {
+            "conversation_id": conversation_id,
+            "question": question,
+            "answer": answer,
+            "created_at": datetime.now(timezone.utc),
+        }
+        try:
+            self._queue.put_nowait((session_id, row))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            logger.warning("對話歷史寫入佇列已滿，捨棄記錄", extra={"session_id": session_id})
+            return
+        self.stats["queued"] += 1
+        self._pending.setdefault(session_id, []).append(row)
+
+        entry = self._cache.get(session_id)
+        if entry is not None:
+            expires_at, rows = entry
+            self._cache[session_id] = (expires_at, self._merge(rows, [row]))
+
+    def _merge(self, rows, new_rows):
+        """合併記錄並依時間由新到舊保留 retention 筆"""
+        merged = {row["conversation_id"]: row for row in rows + new_rows}
+        return sorted(merged.values(), key=lambda row: row["created_at"], reverse=True)[:self.retention]
+
+    async def list(self, session_id: str):
+        """回傳 session 最新的記錄，由新到舊"""
+        entry = self._cache.get(session_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._cache.move_to_end(session_id)
+            CACHE_LOOKUPS.labels("history", "hit").inc()
+            return list(entry[1])
+
+        CACHE_LOOKUPS.labels("history", "miss").inc()
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            cur = await conn.execute("""
+                SELECT conversation_id,
+                       state->>'question' as question,
+                       state->>'generation' as answer,
+                       created_at
+                FROM conversation_history
+                WHERE session_id = %s
+                ORDER BY created_at DESC
+                LIMIT %s
+            """, (session_id, self.retention))
+            records = await cur.fetchall()
+
+        rows = [
+            {"conversation_id": r[0], "question": r[1], "answer": r[2], "created_at": r[3]}
+            for r in records
+        ]
+        rows = self._merge(rows, self._pending.get(session_id, []))
+        self._cache[session_id] = (time.monotonic() + self.cache_ttl, rows)
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > self.cache_max_sessions:
+            self._cache.popitem(last=False)
+        return list(rows)
+
+    async def _next_batch(self):
+        """等待第一筆記錄，之後在 flush_interval 內盡量湊滿一批；收到結束標記時回傳 (批次, True)"""
+        item = await self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = await self._next_batch()
+            if batch:
+                await self._write(batch)
+            if self.max_age_days and (
+                    self._pruned_at is None or time.monotonic() - self._pruned_at > self.prune_interval):
+                await self._prune_expired()
+
+    async def _write(self, batch):
+        """批次寫入並只修剪本批涉及的 session"""
+        sessions = sorted({session_id for session_id, _ in batch})
+        try:
+            pool = await self.get_pool()
+            async with pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.executemany("""
+                        INSERT INTO conversation_history (conversation_id, session_id, state, created_at)
+                        VALUES (%s, %s, %s::jsonb, %s)
+                        ON CONFLICT (conversation_id) DO NOTHING
+                    """, [
+                        (row["conversation_id"], session_id,
+                         json.dumps({"question": row["question"], "generation": row["answer"]}),
+                         row["created_at"])
+                        for session_id, row in batch
+                    ])
+                    # 以 (session_id, created_at) 索引找出超過保留筆數的記錄
+                    await cur.executemany("""
+                        DELETE FROM conversation_history
+                        WHERE conversation_id IN (
+                            SELECT conversation_id FROM conversation_history
+                            WHERE session_id = %s
+                            ORDER BY created_at DESC
+                            OFFSET %s
+                        )
+                    """, [(session_id, self.retention) for session_id in sessions])
+                    await conn.commit()
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+            logger.debug("對話歷史批次寫入完成", extra={"rows": len(batch), "sessions": len(sessions)})
+        except Exception as e:
+            logger.exception(f"保存對話歷史時發生錯誤: {str(e)}", extra={"rows": len(batch)})
+        finally:
+            for session_id, row in batch:
+                pending = [r for r in self._pending.get(session_id, []) if r is not row]
+                if pending:
+                    self._pending[session_id] = pending
+                else:
+                    self._pending.pop(session_id, None)
+
+    async def _prune_expired(self):
+        """刪除超過保存天數的記錄"""
+        self._pruned_at = time.monotonic()
+        try:
+            pool = await self.get_pool()
+            async with pool.connection() as conn:
+                cur = await conn.execute("""
+                    DELETE FROM conversation_history
+                    WHERE created_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+                """, (self.max_age_days,))
+                if cur.rowcount:
+                    logger.info("刪除過期對話歷史", extra={"rows": cur.rowcount})
+        except Exception as e:
+            logger.exception(f"刪除過期對話歷史時發生錯誤: {str(e)}")
+
+
+def create_history_store(get_pool):
+    """依設定建立對話歷史"""
+    return HistoryStore(
+        get_pool,
+        retention=HISTORY_RETENTION,
+        max_age_days=HISTORY_MAX_AGE_DAYS,
+        batch_size=HISTORY_BATCH_SIZE,
+        flush_interval=HISTORY_FLUSH_INTERVAL,
+        queue_size=HISTORY_QUEUE_SIZE,
+        prune_interval=HISTORY_PRUNE_INTERVAL,
+        cache_ttl=HISTORY_CACHE_TTL,
+        cache_max_sessions=HISTORY_CACHE_MAX_SESSIONS,
+    )
@@ -1,20 +1,91 @@
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
-from config.config import OPENAI_API_KEY  # 從 config 引入
+import httpx
+from services.cassette import CassetteChatOpenAI, get_cassette
+from config.config import (  # 從 config 引入
+    OPENAI_API_KEY,
+    LLM_MODEL,
+    LLM_TEMPERATURE,
+    LLM_TIMEOUT,
+    LLM_KEEPALIVE,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE_CONNECTIONS,
+    LLM_KEEPALIVE_EXPIRY,
+    LLM_POOL_CONFIG
+)
 
+# 行程內共用的 LLM 用戶端與 HTTP 連線池，依模型名稱與參數區分
+_llms = {}
+_http_clients = {}
 
-def get_openai_llm():
-    """獲取 OpenAI LLM"""
-    return ChatOpenAI(
-        model="gpt-4o-mini",
-        temperature=0.7,
-        api_key=OPENAI_API_KEY
-    )
 
+def get_pool_config(model: str):
+    """取得模型的連線池設定，LLM_POOL_CONFIG 中的設定優先"""
+    config = {
+        "keepalive": LLM_KEEPALIVE,
+        "max_connections": LLM_MAX_CONNECTIONS,
+        "max_keepalive_connections": LLM_MAX_KEEPALIVE_CONNECTIONS,
+        "keepalive_expiry": LLM_KEEPALIVE_EXPIRY,
+        "timeout": LLM_TIMEOUT,
+    }
+    config.update(LLM_POOL_CONFIG.get(model, {}))
+    return config
 
-def get_gemini_llm():
+
+def get_http_clients(model: str):
+    """取得模型共用的同步與非同步 HTTP 用戶端"""
+    if model not in _http_clients:
+        config = get_pool_config(model)
+        limits = httpx.Limits(
+            max_connections=config["max_connections"],
+            # 關閉連線重用時不保留閒置連線，每次請求重新連線
+            max_keepalive_connections=config["max_keepalive_connections"] if config["keepalive"] else 0,
+            keepalive_expiry=config["keepalive_expiry"],
+        )
+        _http_clients[model] = (
+            httpx.Client(limits=limits, timeout=config["timeout"]),
+            httpx.AsyncClient(limits=limits, timeout=config["timeout"]),
+        )
+    return _http_clients[model]
+
+
+def get_openai_llm(model: str = LLM_MODEL, temperature: float = LLM_TEMPERATURE,
+                   max_tokens: int = None):
+    """獲取 OpenAI LLM，同一模型與參數共用用戶端與連線池，啟用卡帶時經由卡帶錄製或重播"""
+    key = ("openai", model, temperature, max_tokens)
+    if key not in _llms:
+        http_client, http_async_client = get_http_clients(model)
+        cassette = get_cassette()
+        options = {"cassette": cassette} if cassette else {}
+        _llms[key] = (CassetteChatOpenAI if cassette else ChatOpenAI)(
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            # 串流時也回傳 token 用量，供監控指標統計
+            stream_usage=True,
+            api_key=OPENAI_API_KEY,
+            http_client=http_client,
+            http_async_client=http_async_client,
+            **options
+        )
+    return _llms[key]
+
+
+def get_gemini_llm(model: str = "gemini-1.5-pro", temperature: float = 0.7):
     """獲取 Gemini LLM"""
-    return ChatGoogleGenerativeAI(
-        model="gemini-1.5-pro",
-        temperature=0.7
-    )
+    key = ("gemini", model, temperature)
+    if key not in _llms:
+        _llms[key] = ChatGoogleGenerativeAI(
+            model=model,
+            temperature=temperature
+        )
+    return _llms[key]
+
+
+async def close_llm_clients():
+    """關閉共用的 HTTP 連線池"""
+    for http_client, http_async_client in _http_clients.values():
+        http_client.close()
+        await http_async_client.aclose()
+    _http_clients.clear()
+    _llms.clear()
@@ -1,6 +1,16 @@
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.messages import BaseMessage
 from services.llm import get_openai_llm
 from pydantic import BaseModel, Field
+from typing import List, Literal
+from config.config import (
+    GRADER_OUTPUT_MODE,
+    GRADER_MAX_TOKENS,
+    GRADER_TEMPERATURE,
+    GRADER_MODEL,
+    GRADER_MODELS
+)
+import re
 
 
 # 定義工具類別
@@ -18,9 +28,70 @@ class vectorstore(BaseModel):
     query: str = Field(description="搜尋向量資料庫時輸入的問題")
 
 
+class binary_score(BaseModel):
+    """
+    評分結果，只能是 'yes' 或 'no'。
+    """
+    score: Literal["yes", "no"] = Field(description="評分結果，'yes' 或 'no'")
+
+
+class retrieval_grades(BaseModel):
+    """
+    依文件編號順序回傳每份文件與問題的相關性評分。
+    """
+    scores: List[Literal["yes", "no"]] = Field(
+        description="每份文件的評分，與文件編號順序一致，相關為 'yes'，不相關為 'no'")
+
+
+# 英文 yes/no 與常見中文肯定、否定回答
+YES_PATTERN = re.compile(r"\b(yes|true)\b|^(是|有|相關|符合)")
+NO_PATTERN = re.compile(r"\b(no|false)\b|^(否|不|沒有|無)")
+
+
+def parse_verdict(output, default: str = "no") -> str:
+    """將評分輸出解析為 'yes' 或 'no'
+
+    接受結構化輸出、AIMessage 或字串，容忍大小寫、標點與附加說明（例如 "Yes." 或 "no, because..."），
+    無法判斷時回傳 default。
+    """
+    if isinstance(output, BaseModel) and hasattr(output, "score"):
+        output = output.score
+    elif isinstance(output, BaseMessage):
+        output = output.content
+    text = str(output).strip().strip("'\"`*.。!！ ").lower()
+    yes = YES_PATTERN.search(text)
+    no = NO_PATTERN.search(text)
+    if yes and (not no or yes.start() < no.start()):
+        return "yes"
+    if no:
+        return "no"
+    return default
+
+
+def get_grader_llm(name: str):
+    """取得評分器使用的 LLM，可依評分器名稱指定模型"""
+    return get_openai_llm(
+        model=GRADER_MODELS.get(name, GRADER_MODEL),
+        temperature=GRADER_TEMPERATURE,
+        max_tokens=GRADER_MAX_TOKENS
+    )
+
+
+def create_binary_grader(name: str, prompt: ChatPromptTemplate):
+    """創建 yes/no 評分 chain，依 GRADER_OUTPUT_MODE 使用結構化輸出或限制 token 數的文字回答"""
+    llm = get_grader_llm(name)
+    if GRADER_OUTPUT_MODE == "structured":
+        return prompt | llm.with_structured_output(binary_score)
+    return prompt | llm
+
+
 def create_question_router():
     """創建問題路由 LLM"""
-    llm = get_openai_llm()
+    # 工具呼叫需包含查詢字串，不限制輸出 token 數
+    llm = get_openai_llm(
+        model=GRADER_MODELS.get("question_router", GRADER_MODEL),
+        temperature=GRADER_TEMPERATURE
+    )
     instruction = """
     你是一個專業的問題分類專家，負責將使用者問題導向最適合的搜尋工具。請根據以下規則選擇工具：
 
@@ -46,7 +117,6 @@ def create_question_router():
 
 def create_question_grader():
     """創建評估問題的 LLM"""
-    llm = get_openai_llm()
     instruction = """
     你是內容審核專家，負責識別並過濾不當內容。請依照以下標準評估使用者問題：
 
@@ -61,15 +131,15 @@ def create_question_grader():
     - 請嚴格執行審核標準，確保內容安全
     """
 
-    return ChatPromptTemplate.from_messages([
+    prompt = ChatPromptTemplate.from_messages([
         ("system", instruction),
         ("human", "{question}"),
-    ]) | llm
+    ])
+    return create_binary_grader("question_grader", prompt)
 
 
 def create_retrieval_grader():
     """創建評估檢索結果的 LLM"""
-    llm = get_openai_llm()
     instruction = """
     你是搜尋結果評估專家，負責判斷檢索文件與使用者問題的相關性。評估標準如下：
 
@@ -83,15 +153,42 @@ def create_retrieval_grader():
     - 不符合標準，請回答 'no'
     """
 
-    return ChatPromptTemplate.from_messages([
+    prompt = ChatPromptTemplate.from_messages([
         ("system", instruction),
         ("human", "文件: \n\n {document} \n\n 使用者問題: {question}"),
-    ]) | llm
+    ])
+    return create_binary_grader("retrieval_grader", prompt)
+
+
+def create_batch_retrieval_grader():
+    """創建單次評估多份檢索結果的 LLM"""
+    # 輸出長度隨文件數增加，不限制輸出 token 數
+    llm = get_openai_llm(
+        model=GRADER_MODELS.get("retrieval_grader", GRADER_MODEL),
+        temperature=GRADER_TEMPERATURE
+    )
+    instruction = """
+    你是搜尋結果評估專家，負責判斷每份檢索文件與使用者問題的相關性。評估標準如下：
+
+    相關性判斷標準：
+    1. 關鍵字匹配：文件是否包含問題中的重要關鍵字
+    2. 語意相關：文件內容是否在語意層面回答了問題
+    3. 資訊完整性：文件是否包含回答問題所需的核心資訊
+
+    回答規則：
+    - 依文件編號順序，為每份文件給出一個評分
+    - 符合上述標準，評分為 'yes'
+    - 不符合標準，評分為 'no'
+    """
+
+    return ChatPromptTemplate.from_messages([
+        ("system", instruction),
+        ("human", "文件: \n\n {documents} \n\n 使用者問題: {question}"),
+    ]) | llm.with_structured_output(retrieval_grades)
 
 
 def create_hallucination_grader():
     """創建評估幻覺的 LLM"""
-    llm = get_openai_llm()
     instruction = """
     你是答案準確性審查專家，負責檢查生成的回答是否存在幻覺（虛構資訊）。評估標準如下：
 
@@ -105,15 +202,15 @@ def create_hallucination_grader():
     - 回答完全基於文件內容，回答 'no'
     """
 
-    return ChatPromptTemplate.from_messages([
+    prompt = ChatPromptTemplate.from_messages([
         ("system", instruction),
         ("human", "文件: {documents}\n生成回答: {generation}"),
-    ]) | llm
+    ])
+    return create_binary_grader("hallucination_grader", prompt)
 
 
 def create_answer_grader():
     """創建評估回答品質的 LLM"""
-    llm = get_openai_llm()
     instruction = """
     你是回答品質評估專家，負責評估生成回答的完整性與品質。評估標準如下：
 
@@ -128,15 +225,17 @@ def create_answer_grader():
     - 未達到任一標準，回答 'no'
     """
 
-    return ChatPromptTemplate.from_messages([
+    prompt = ChatPromptTemplate.from_messages([
         ("system", instruction),
         ("human", "問題: {question}\n生成回答: {generation}"),
-    ]) | llm
+    ])
+    return create_binary_grader("answer_grader", prompt)
 
 
 # 創建所有 LLM 實例
 question_grader = create_question_grader()
 retrieval_grader = create_retrieval_grader()
+batch_retrieval_grader = create_batch_retrieval_grader()
 hallucination_grader = create_hallucination_grader()
 answer_grader = create_answer_grader()
 question_router = create_question_router()
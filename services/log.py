@@ -0,0 +1,93 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from config.config import LOG_LEVEL, LOG_FORMAT
+
+# LogRecord 內建屬性，其餘屬性視為 extra 傳入的結構化欄位
+RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+def record_fields(record):
+    """取得以 extra 傳入的結構化欄位"""
+    return {k: v for k, v in vars(record).items() if k not in RESERVED_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    """每筆日誌輸出為一行 JSON"""
+
+    def format(self, record):
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        payload.update(record_fields(record))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        if record.stack_info:
+            payload["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """以 key=value 附加結構化欄位的文字格式"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def formatMessage(self, record):
+        # 結構化欄位接在訊息之後、traceback 之前
+        line = super().formatMessage(record)
+        fields = record_fields(record)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """排入佇列前只展開訊息參數，例外以 exc_text 保留為獨立欄位
+
+    預設的 prepare 會將 traceback 併入 msg 並清除 exc_info，輸出端便無法分開輸出。
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # traceback 物件會保留所有 frame，排入佇列前先轉為文字
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """設定根 logger，實際寫出由背景執行緒處理，避免在請求路徑上等待 I/O"""
+    global _listener
+    if _listener is not None:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [StructuredQueueHandler(log_queue)]
+    root.setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str):
+    """取得模組 logger"""
+    return logging.getLogger(name)
@@ -0,0 +1,138 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import Counter, Histogram
+import functools
+import inspect
+import time
+from services.log import get_logger
+
+logger = get_logger(__name__)
+
+# 節點與路由
+NODE_LATENCY = Histogram(
+    "rag_node_duration_seconds", "工作流程節點執行時間", ["node"])
+NODE_ERRORS = Counter(
+    "rag_node_errors_total", "工作流程節點錯誤次數", ["node"])
+ROUTE_DECISIONS = Counter(
+    "rag_route_decisions_total", "路由決策次數", ["router", "decision"])
+RETRIES = Counter(
+    "rag_retries_total", "重試次數（web_search_retry_count、rag_generate_retry_count）", ["kind"])
+
+# LLM
+LLM_LATENCY = Histogram(
+    "rag_llm_duration_seconds", "LLM 呼叫時間", ["model"])
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total", "LLM token 數", ["model", "kind"])
+LLM_ERRORS = Counter(
+    "rag_llm_errors_total", "LLM 呼叫錯誤次數", ["model"])
+
+# Embedding 與網路搜尋
+EMBEDDING_LATENCY = Histogram(
+    "rag_embedding_duration_seconds", "遠端 embedding 請求時間", ["kind"])
+EMBEDDING_TEXTS = Counter(
+    "rag_embedding_texts_total", "送往遠端 embedding 的文字數", ["kind"])
+EMBEDDING_RETRIES = Counter(
+    "rag_embedding_retries_total", "embedding 限流重試次數")
+SEARCH_LATENCY = Histogram(
+    "rag_web_search_duration_seconds", "Tavily 搜尋請求時間")
+
+# 快取與本地短路
+CACHE_LOOKUPS = Counter(
+    "rag_cache_lookups_total", "快取查詢次數", ["cache", "result"])
+FAST_ROUTES = Counter(
+    "rag_fast_router_total", "快速路由結果", ["result"])
+FAST_ROUTE_AUDITS = Counter(
+    "rag_fast_router_audits_total", "快速路由與 LLM 路由抽樣比對結果", ["result"])
+PRE_MODERATION = Counter(
+    "rag_pre_moderation_total", "本地預先審核結果", ["result"])
+
+
+def instrument_node(name: str, func):
+    """包裝工作流程節點，記錄執行時間與錯誤次數"""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(state):
+            start = time.perf_counter()
+            try:
+                return await func(state)
+            except Exception:
+                NODE_ERRORS.labels(name).inc()
+                raise
+            finally:
+                NODE_LATENCY.labels(name).observe(time.perf_counter() - start)
+        return wrapper
+
+    @functools.wraps(func)
+    def wrapper(state):
+        start = time.perf_counter()
+        try:
+            return func(state)
+        except Exception:
+            NODE_ERRORS.labels(name).inc()
+            raise
+        finally:
+            NODE_LATENCY.labels(name).observe(time.perf_counter() - start)
+    return wrapper
+
+
+def instrument_router(name: str, func):
+    """包裝條件路由，另外記錄路由決策"""
+    timed = instrument_node(name, func)
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(state):
+            decision = await timed(state)
+            ROUTE_DECISIONS.labels(name, str(decision)).inc()
+            return decision
+        return wrapper
+
+    @functools.wraps(func)
+    def wrapper(state):
+        decision = timed(state)
+        ROUTE_DECISIONS.labels(name, str(decision)).inc()
+        return decision
+    return wrapper
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """記錄每次 LLM 呼叫的時間與 prompt/completion token 數"""
+
+    # 只更新計數器，直接在呼叫端執行，不排入執行緒池
+    run_inline = True
+
+    def __init__(self):
+        self._runs = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        model = (metadata or {}).get("ls_model_name", "unknown")
+        self._runs[run_id] = (model, time.perf_counter())
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self.on_chat_model_start(serialized, prompts, run_id=run_id, metadata=metadata)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        model, start = self._runs.pop(run_id, ("unknown", None))
+        if start is not None:
+            LLM_LATENCY.labels(model).observe(time.perf_counter() - start)
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+        if not prompt_tokens and response.llm_output:
+            usage = response.llm_output.get("token_usage") or {}
+            prompt_tokens = usage.get("prompt_tokens", 0)
+            completion_tokens = usage.get("completion_tokens", 0)
+        LLM_TOKENS.labels(model, "prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(model, "completion").inc(completion_tokens)
+        logger.debug("llm call", extra={
+            "model": model, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens})
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        model, _ = self._runs.pop(run_id, ("unknown", None))
+        LLM_ERRORS.labels(model).inc()
+
+
+# 所有查詢共用的 callback，於 app.create_run 加入設定
+metrics_callback = MetricsCallbackHandler()
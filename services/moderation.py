@@ -0,0 +1,176 @@
+from collections import deque
+import json
+import re
+import unicodedata
+from services.metrics import PRE_MODERATION
+from services.log import get_logger
+from config.config import MODERATION_LEXICON, MODERATION_STRICT
+
+logger = get_logger(__name__)
+
+# 預設詞庫，含繁體與簡體寫法。
+# block：明確不當內容，問題中沒有交通法規用語時直接拒答；review：可能不當，交由 LLM 審核；
+# allow：交通法規用語，涵蓋的 block/review 詞不計（例如「毒駕」中的「毒」、「安全性」中的「性」），
+# 與 block 詞同時出現時改交由 LLM 審核（例如「吸毒後騎機車的罰則」）；
+# 命中 allow 詞且沒有 block/review 詞的問題為明確的交通法規問題，視為安全。
+DEFAULT_LEXICON = {
+    "block": [
+        # 暴力
+        "殺人", "殺了他", "殺死他", "砍死", "虐殺", "槍殺", "炸彈", "製作炸彈", "恐怖攻擊",
+        "杀人", "杀了他", "杀死他", "枪杀", "炸弹", "制作炸弹", "恐怖袭击",
+        "kill someone", "make a bomb",
+        # 色情
+        "色情", "性交", "做愛", "裸照", "援交", "a片", "成人影片",
+        "做爱", "porn",
+        # 毒品
+        "吸毒", "販毒", "買毒品", "安非他命", "海洛因", "古柯鹼", "大麻", "搖頭丸", "k他命", "冰毒",
+        "贩毒", "买毒品", "可卡因", "摇头丸",
+        "cocaine", "heroin",
+    ],
+    "review": [
+        "殺", "砍", "槍", "炸", "毒", "藥", "性", "死", "血", "打架", "攻擊", "報復", "裸",
+        "杀", "枪", "药", "攻击", "报复",
+        "weapon", "drug", "sex",
+    ],
+    "allow": [
+        "機車", "重機", "重型機車", "駕照", "考照", "路考", "筆試", "駕訓班", "路權", "標線", "標誌",
+        "號誌", "車道", "高速公路", "速限", "安全帽", "罰鍰", "罰則", "違規", "交通", "道路", "騎乘", "駕駛",
+        "酒駕", "毒駕", "藥駕", "安全性", "性能", "死角", "致死", "肇事", "擦撞", "追撞",
+        "机车", "驾照", "考照", "路权", "标线", "标志", "号志", "车道", "速限", "安全帽", "罚款", "违规",
+        "交通", "道路", "骑乘", "驾驶", "酒驾", "毒驾", "药驾",
+    ],
+}
+
+# 比對前移除空白與標點，避免以「大 麻」之類的間隔規避
+SEPARATOR_PATTERN = re.compile(r"[\s\W_]+")
+
+
+def normalize_text(text: str) -> str:
+    """全半形統一、轉小寫並移除空白與標點"""
+    return SEPARATOR_PATTERN.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+class AhoCorasick:
+    """多模式字串比對自動機，一次掃描找出所有詞彙出現位置"""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        for pattern, value in patterns.items():
+            self._add(pattern, value)
+        self._build()
+
+    def _add(self, pattern, value):
+        state = 0
+        for char in pattern:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.outputs[state].append((len(pattern), value))
+
+    def _build(self):
+        """以廣度優先建立失敗連結，並合併後綴節點的輸出"""
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                if self.fail[child] == child:
+                    self.fail[child] = 0
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def iter(self, text: str):
+        """產生 (起點, 終點, 值)"""
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, value in self.outputs[state]:
+                yield index - length + 1, index + 1, value
+
+
+def load_lexicon(path: str = ""):
+    """載入詞庫 JSON（{"block": [...], "review": [...], "allow": [...]}），未設定時使用預設詞庫"""
+    if not path:
+        return DEFAULT_LEXICON
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+class PreModerator:
+    """在 LLM 內容審核前以詞庫判斷明確不當的問題
+
+    check 回傳 'yes'（不當）、'no'（安全）或 None（不確定，需交由 LLM 審核）。
+    命中 allow 詞且未命中 block 與 review 詞的問題判為安全；完全未命中詞庫的問題交由 LLM 審核。
+    strict 時只在本地判斷不當的問題，其餘都交由 LLM 審核。
+    """
+
+    def __init__(self, lexicon=None, strict: bool = False):
+        lexicon = lexicon or DEFAULT_LEXICON
+        patterns = {}
+        # 同一詞彙出現在多個類別時以較嚴格者為準
+        for category in ("allow", "review", "block"):
+            for term in lexicon.get(category, []):
+                term = normalize_text(term)
+                if term:
+                    patterns[term] = category
+        self.automaton = AhoCorasick(patterns)
+        self.strict = strict
+        self.stats = {"checked": 0, "blocked": 0, "allowed": 0, "escalated": 0}
+
+    def classify(self, question: str):
+        """回傳 'block'、'review'、'allow'（只命中 allow 詞）或 None（未命中）
+
+        block 詞與 allow 詞同時出現時可能是合法的法規問題，降為 review。
+        """
+        matches = list(self.automaton.iter(normalize_text(question)))
+        allowed = [(start, end) for start, end, category in matches if category == "allow"]
+        categories = set()
+        for start, end, category in matches:
+            if category == "allow" or any(s <= start and end <= e for s, e in allowed):
+                continue
+            categories.add(category)
+        if "block" in categories:
+            return "review" if allowed else "block"
+        if "review" in categories:
+            return "review"
+        return "allow" if allowed else None
+
+    def check(self, question: str):
+        """回傳 'yes'、'no' 或 None，並更新統計"""
+        category = self.classify(question)
+        self.stats["checked"] += 1
+        if category == "block":
+            self.stats["blocked"] += 1
+            PRE_MODERATION.labels("block").inc()
+            logger.info("pre-moderation blocked question")
+            return "yes"
+        if category == "allow" and not self.strict:
+            self.stats["allowed"] += 1
+            PRE_MODERATION.labels("allow").inc()
+            logger.debug("pre-moderation allowed question")
+            return "no"
+        self.stats["escalated"] += 1
+        PRE_MODERATION.labels("escalate").inc()
+        logger.debug("pre-moderation escalated to llm grader")
+        return None
+
+    def avoided_calls(self):
+        """本地判斷而省下的 LLM 審核次數"""
+        return self.stats["blocked"] + self.stats["allowed"]
+
+    def report(self):
+        """輸出預先審核統計"""
+        logger.info("pre-moderation", extra={**self.stats, "avoided_calls": self.avoided_calls()})
+
+
+pre_moderator = PreModerator(load_lexicon(MODERATION_LEXICON), strict=MODERATION_STRICT)
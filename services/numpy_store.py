@@ -0,0 +1,257 @@
+from langchain_core.vectorstores import VectorStore
+from langchain_core.documents import Document
+import json
+import os
+import uuid
+import numpy as np
+
+VECTORS_FILE = "vectors.f32"
+DOCUMENTS_FILE = "documents.jsonl"
+META_FILE = "meta.json"
+# 舊版格式，載入時轉換
+LEGACY_VECTORS_FILE = "embeddings.npy"
+# 已刪除的列超過此比例時壓縮檔案
+COMPACT_RATIO = 0.5
+
+
+class NumpyVectorStore(VectorStore):
+    """以記憶體映射儲存正規化 float32 向量的行程內向量資料庫
+
+    向量檔與文件記錄只會附加：新增時附加在檔案結尾，刪除與更新以刪除記錄標記舊列，
+    已刪除的列超過 COMPACT_RATIO 時才重寫檔案。
+    """
+
+    def __init__(self, embedding, persist_directory=None):
+        self._embedding = embedding
+        self.persist_directory = persist_directory
+        self._dim = None
+        self._vectors = None
+        self._alive = np.zeros(0, dtype=bool)
+        self._documents = []
+        self._positions = {}
+        if persist_directory:
+            if os.path.exists(os.path.join(persist_directory, LEGACY_VECTORS_FILE)):
+                self._migrate()
+            if os.path.exists(os.path.join(persist_directory, META_FILE)):
+                self._load()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _path(self, name):
+        return os.path.join(self.persist_directory, name)
+
+    def _load(self):
+        """重播文件記錄，以唯讀記憶體映射載入向量"""
+        with open(self._path(META_FILE), encoding="utf-8") as file:
+            self._dim = json.load(file)["dim"]
+        self._documents = []
+        self._positions = {}
+        alive = []
+        lines = [b""]
+        if os.path.exists(self._path(DOCUMENTS_FILE)):
+            with open(self._path(DOCUMENTS_FILE), "rb") as file:
+                lines = file.read().split(b"\n")
+        if lines[-1]:
+            # 截斷寫入中斷的最後一行，之後的記錄才能接續附加
+            with open(self._path(DOCUMENTS_FILE), "r+b") as file:
+                file.truncate(sum(len(line) + 1 for line in lines[:-1]))
+        for line in lines[:-1]:
+            record = json.loads(line)
+            if "delete" in record:
+                row = self._positions.pop(record["delete"], None)
+                if row is not None:
+                    alive[row] = False
+                continue
+            if record["id"] in self._positions:
+                alive[self._positions[record["id"]]] = False
+            self._positions[record["id"]] = len(self._documents)
+            alive.append(True)
+            self._documents.append(Document(
+                id=record["id"],
+                page_content=record["page_content"],
+                metadata=record["metadata"]))
+        self._alive = np.array(alive, dtype=bool)
+        self._map()
+
+    def _map(self):
+        """以記憶體映射開啟已寫入記錄的列，檔案結尾未記錄的向量忽略"""
+        rows = len(self._documents)
+        if not rows:
+            self._vectors = None
+            return
+        self._vectors = np.memmap(
+            self._path(VECTORS_FILE), dtype=np.float32, mode="r", shape=(rows, self._dim))
+
+    def _migrate(self):
+        """將舊版 .npy 格式轉為附加式格式"""
+        vectors = np.load(self._path(LEGACY_VECTORS_FILE), mmap_mode="r")
+        with open(self._path(DOCUMENTS_FILE), encoding="utf-8") as file:
+            records = [json.loads(line) for line in file]
+        self._write_all(np.asarray(vectors), records, vectors.shape[1])
+        os.remove(self._path(LEGACY_VECTORS_FILE))
+
+    def _write_all(self, vectors, records, dim):
+        """重寫全部檔案，先寫入暫存檔再取代"""
+        os.makedirs(self.persist_directory, exist_ok=True)
+        with open(self._path(VECTORS_FILE) + ".tmp", "wb") as file:
+            file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self._path(DOCUMENTS_FILE) + ".tmp", "w", encoding="utf-8") as file:
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        with open(self._path(META_FILE), "w", encoding="utf-8") as file:
+            json.dump({"dim": dim}, file)
+        os.replace(self._path(VECTORS_FILE) + ".tmp", self._path(VECTORS_FILE))
+        os.replace(self._path(DOCUMENTS_FILE) + ".tmp", self._path(DOCUMENTS_FILE))
+
+    def _append(self, rows, vectors, records):
+        """將向量與文件記錄附加到檔案結尾；先寫入向量，記錄寫入後該列才會被載入"""
+        os.makedirs(self.persist_directory, exist_ok=True)
+        if not os.path.exists(self._path(META_FILE)):
+            with open(self._path(META_FILE), "w", encoding="utf-8") as file:
+                json.dump({"dim": self._dim}, file)
+        if vectors is not None:
+            with open(self._path(VECTORS_FILE), "ab") as file:
+                # 截斷先前中斷而未記錄的向量
+                file.truncate(rows * self._dim * 4)
+                file.write(vectors.tobytes())
+        with open(self._path(DOCUMENTS_FILE), "a", encoding="utf-8") as file:
+            file.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        """加入已計算的向量，相同 ID 視為更新"""
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+
+        vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        if self._dim is None:
+            self._dim = vectors.shape[1]
+        rows = len(self._documents)
+        alive = np.ones(len(ids), dtype=bool)
+        for offset, doc_id in enumerate(ids):
+            row = self._positions.get(doc_id)
+            if row is not None and row >= rows:
+                # 同一批次內重複的 ID 以最後一個為準
+                alive[row - rows] = False
+            elif row is not None:
+                self._alive[row] = False
+            self._positions[doc_id] = rows + offset
+        self._alive = np.concatenate([self._alive, alive])
+        self._documents.extend(
+            Document(id=i, page_content=t, metadata=m)
+            for i, t, m in zip(ids, texts, metadatas))
+
+        if self.persist_directory:
+            self._append(rows, vectors, [
+                {"id": i, "page_content": t, "metadata": m}
+                for i, t, m in zip(ids, texts, metadatas)])
+            self._map()
+        elif self._vectors is None:
+            self._vectors = vectors
+        else:
+            self._vectors = np.vstack([self._vectors, vectors])
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        embeddings = self._embedding.embed_documents(texts)
+        return self.add_embeddings(texts, embeddings, metadatas, ids)
+
+    async def aadd_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        embeddings = await self._embedding.aembed_documents(texts)
+        return self.add_embeddings(texts, embeddings, metadatas, ids)
+
+    def delete(self, ids=None, **kwargs):
+        """依 ID 刪除向量，只附加刪除記錄"""
+        removed = [i for i in dict.fromkeys(ids or []) if i in self._positions]
+        if not removed:
+            return False
+        for doc_id in removed:
+            self._alive[self._positions.pop(doc_id)] = False
+        if self.persist_directory:
+            self._append(len(self._documents), None, [{"delete": doc_id} for doc_id in removed])
+        if (~self._alive).sum() > COMPACT_RATIO * len(self._alive):
+            self.compact()
+        return True
+
+    def compact(self):
+        """移除已刪除的列並重寫檔案"""
+        if self._dim is None:
+            return
+        keep = np.flatnonzero(self._alive)
+        vectors = np.asarray(self._vectors)[keep] if self._vectors is not None else None
+        self._documents = [self._documents[i] for i in keep]
+        self._positions = {doc.id: row for row, doc in enumerate(self._documents)}
+        self._alive = np.ones(len(keep), dtype=bool)
+        if not self.persist_directory:
+            self._vectors = vectors
+            return
+        self._write_all(
+            vectors if vectors is not None else np.zeros((0, self._dim), dtype=np.float32),
+            [{"id": d.id, "page_content": d.page_content, "metadata": d.metadata}
+             for d in self._documents],
+            self._dim)
+        self._map()
+
+    def get_by_ids(self, ids):
+        return [self._documents[self._positions[i]] for i in ids if i in self._positions]
+
+    def batch_search_by_vectors(self, embeddings, k=4):
+        """以矩陣乘積批次計算餘弦相似度，argpartition 取前 k 名"""
+        if not self._positions:
+            return [[] for _ in embeddings]
+        queries = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        scores = queries @ self._vectors.T
+        if len(self._positions) < len(self._alive):
+            scores[:, ~self._alive] = -np.inf
+        k = min(k, len(self._positions))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in zip(scores, top):
+            ordered = candidates[np.argsort(-row[candidates])]
+            results.append([(self._documents[i], float(row[i])) for i in ordered])
+        return results
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        return self.batch_search_by_vectors([embedding], k)[0]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        embedding = self._embedding.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    async def asimilarity_search(self, query, k=4, **kwargs):
+        embedding = await self._embedding.aembed_query(query)
+        return self.similarity_search_by_vector(embedding, k)
+
+    def _similarity_search_with_relevance_scores(self, query, k=4, **kwargs):
+        # 餘弦相似度 [-1, 1] 轉換為 [0, 1]
+        return [(doc, (score + 1.0) / 2.0) for doc, score in self.similarity_search_with_score(query, k)]
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory=None, **kwargs):
+        store = cls(embedding, persist_directory=persist_directory)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+
+def normalize_rows(vectors):
+    """將每列向量正規化為單位長度"""
+    if vectors.ndim == 1:
+        vectors = vectors[np.newaxis, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
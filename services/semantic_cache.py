@@ -0,0 +1,211 @@
+import asyncio
+import time
+import numpy as np
+from services.embeddings import get_embeddings
+from data.data import get_index_version
+from services.metrics import CACHE_LOOKUPS
+from services.log import get_logger
+from config.config import (
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_TTL,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_SYNC_INTERVAL
+)
+
+logger = get_logger(__name__)
+
+
+class SemanticCache:
+    """以問題向量為鍵的語意答案快取，存於 Postgres 供多個 worker 共用
+
+    行程內鏡像由背景 task 每 SEMANTIC_CACHE_SYNC_INTERVAL 秒自資料庫重新載入，不在請求路徑上同步。
+    """
+
+    def __init__(self, get_pool):
+        self.get_pool = get_pool
+        self.index_version = None
+        self.embeddings = None
+        self.hits = 0
+        self.misses = 0
+        # 行程內鏡像，定期由資料庫同步
+        self._ids = []
+        self._answers = []
+        self._created_at = []
+        # 預先配置的向量矩陣，前 _size 列有效，容量不足時加倍
+        self._matrix = None
+        self._size = 0
+        self._task = None
+
+    async def setup(self, index_version):
+        """建立快取表格並清除舊索引版本的答案"""
+        self.index_version = index_version
+        self.embeddings = get_embeddings()
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    CREATE TABLE IF NOT EXISTS semantic_cache (
+                        cache_id BIGSERIAL PRIMARY KEY,
+                        question TEXT NOT NULL,
+                        embedding REAL[] NOT NULL,
+                        answer TEXT NOT NULL,
+                        index_version TEXT NOT NULL,
+                        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                        last_hit_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                await cur.execute("""
+                    CREATE INDEX IF NOT EXISTS semantic_cache_last_hit_idx
+                    ON semantic_cache (last_hit_at)
+                """)
+                await conn.commit()
+        await self.invalidate(index_version)
+        await self._sync()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """停止背景同步"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(SEMANTIC_CACHE_SYNC_INTERVAL)
+            try:
+                await self._sync()
+            except Exception as e:
+                logger.exception(f"同步語意快取時發生錯誤: {str(e)}")
+
+    async def invalidate(self, index_version):
+        """向量索引重建後清除其他版本的快取"""
+        self.index_version = index_version
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            await conn.execute(
+                "DELETE FROM semantic_cache WHERE index_version <> %s",
+                (index_version,))
+        self._reset()
+
+    def _reset(self):
+        """清空行程內鏡像"""
+        self._ids = []
+        self._answers = []
+        self._created_at = []
+        self._matrix = None
+        self._size = 0
+
+    async def _sync(self):
+        """自資料庫重新載入目前版本且未過期的快取"""
+        version = self.index_version
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            cur = await conn.execute("""
+                SELECT cache_id, embedding, answer, EXTRACT(EPOCH FROM created_at)
+                FROM semantic_cache
+                WHERE index_version = %s
+                  AND created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                ORDER BY cache_id
+            """, (version, SEMANTIC_CACHE_TTL))
+            rows = await cur.fetchall()
+
+        # 一次建立整個矩陣，在執行緒中計算以免阻塞事件迴圈
+        matrix = await asyncio.to_thread(normalize_rows, [row[1] for row in rows])
+        if version != self.index_version:
+            return
+        self._ids = [row[0] for row in rows]
+        self._answers = [row[2] for row in rows]
+        self._created_at = [float(row[3]) for row in rows]
+        self._matrix = matrix
+        self._size = len(rows)
+
+    def _append(self, cache_id, embedding, answer, created_at):
+        """加入一筆快取至行程內鏡像"""
+        vector = normalize(embedding)
+        if self._matrix is None or self._matrix.shape[1] != len(vector):
+            self._matrix = np.empty((0, len(vector)), dtype=np.float32)
+            self._size = 0
+        if self._size == len(self._matrix):
+            grown = np.empty((max(16, 2 * self._size), len(vector)), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+        self._matrix[self._size] = vector
+        self._size += 1
+        self._ids.append(cache_id)
+        self._answers.append(answer)
+        self._created_at.append(created_at)
+
+    async def lookup(self, question):
+        """查詢相似問題的答案，回傳 (答案或 None, 問題向量)"""
+        embedding = await self.embeddings.aembed_query(question)
+        version = get_index_version()
+        if version != self.index_version:
+            await self.invalidate(version)
+        if not self._size:
+            self.misses += 1
+            CACHE_LOOKUPS.labels("semantic", "miss").inc()
+            return None, embedding
+
+        scores = self._matrix[:self._size] @ normalize(embedding)
+        best = int(np.argmax(scores))
+        expired = time.time() - self._created_at[best] > SEMANTIC_CACHE_TTL
+        if scores[best] < SEMANTIC_CACHE_THRESHOLD or expired:
+            self.misses += 1
+            CACHE_LOOKUPS.labels("semantic", "miss").inc()
+            return None, embedding
+
+        self.hits += 1
+        CACHE_LOOKUPS.labels("semantic", "hit").inc()
+        logger.info("semantic cache hit", extra={"similarity": round(float(scores[best]), 3)})
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            await conn.execute(
+                "UPDATE semantic_cache SET last_hit_at = CURRENT_TIMESTAMP WHERE cache_id = %s",
+                (self._ids[best],))
+        return self._answers[best], embedding
+
+    async def store(self, question, embedding, answer):
+        """保存通過評估的答案並依 TTL 與 LRU 淘汰舊資料"""
+        pool = await self.get_pool()
+        async with pool.connection() as conn:
+            cur = await conn.execute("""
+                INSERT INTO semantic_cache (question, embedding, answer, index_version)
+                VALUES (%s, %s, %s, %s)
+                RETURNING cache_id
+            """, (question, [float(x) for x in embedding], answer, self.index_version))
+            cache_id = (await cur.fetchone())[0]
+            await conn.execute("""
+                DELETE FROM semantic_cache
+                WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            """, (SEMANTIC_CACHE_TTL,))
+            await conn.execute("""
+                DELETE FROM semantic_cache
+                WHERE cache_id IN (
+                    SELECT cache_id FROM semantic_cache
+                    ORDER BY last_hit_at DESC
+                    OFFSET %s
+                )
+            """, (SEMANTIC_CACHE_MAX_ENTRIES,))
+        self._append(cache_id, embedding, answer, time.time())
+
+
+def normalize_rows(vectors):
+    """將多個向量轉為逐列正規化的 float32 矩陣"""
+    if not vectors:
+        return None
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def normalize(vector):
+    """正規化向量以計算餘弦相似度"""
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
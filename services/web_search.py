@@ -0,0 +1,139 @@
+from langchain_community.tools.tavily_search import TavilySearchResults
+from langchain.schema import Document
+from collections import OrderedDict
+import asyncio
+import hashlib
+import re
+import time
+import unicodedata
+from services.metrics import CACHE_LOOKUPS, SEARCH_LATENCY
+from services.cassette import get_cassette
+from services.log import get_logger
+from config.config import (
+    TAVILY_API_KEY,
+    WEB_SEARCH_MAX_RESULTS,
+    WEB_SEARCH_CACHE_TTL,
+    WEB_SEARCH_CACHE_MAX_ENTRIES
+)
+
+logger = get_logger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """正規化查詢字串作為快取鍵：全半形統一、轉小寫並合併空白"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", query)).strip().lower()
+
+
+def content_hash(document: Document) -> str:
+    """以正規化後的內容計算文件雜湊"""
+    text = re.sub(r"\s+", " ", document.page_content).strip()
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def dedupe_documents(documents):
+    """依內容雜湊去除重複文件，保留第一次出現的順序"""
+    seen = set()
+    unique = []
+    for document in documents:
+        key = content_hash(document)
+        if key not in seen:
+            seen.add(key)
+            unique.append(document)
+    return unique
+
+
+class WebSearch:
+    """共用的 Tavily 搜尋，結果依正規化查詢快取 TTL 秒，並合併同時進行的相同查詢"""
+
+    def __init__(self, max_results=5, ttl=3600, max_entries=1000):
+        self.max_results = max_results
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.tool = TavilySearchResults(api_key=TAVILY_API_KEY, max_results=max_results)
+        self.cassette = get_cassette()
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._pending = {}
+
+    def _get(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, documents = entry
+        if expires_at < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return documents
+
+    def _put(self, key, documents):
+        self._cache[key] = (time.monotonic() + self.ttl, documents)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def _invoke(self, query):
+        """呼叫 Tavily，啟用卡帶時經由卡帶錄製或重播"""
+        payload = {"query": query}
+        if self.cassette:
+            return await self.cassette.acall(
+                "web_search", {**payload, "max_results": self.max_results},
+                lambda: self.tool.ainvoke(payload))
+        return await self.tool.ainvoke(payload)
+
+    async def _fetch(self, query):
+        """呼叫 Tavily，失敗時回傳 None 不寫入快取"""
+        with SEARCH_LATENCY.time():
+            results = await self._invoke(query)
+        # 工具發生錯誤時回傳錯誤訊息字串
+        if not isinstance(results, list):
+            logger.error(f"網路搜尋失敗: {results}")
+            return None
+        documents = [
+            Document(page_content=r["content"], metadata={"source": r.get("url")})
+            for r in results[:self.max_results]
+        ]
+        return dedupe_documents(documents)
+
+    async def search(self, query: str):
+        """回傳搜尋結果文件，TTL 內的重複查詢不再呼叫 Tavily"""
+        key = normalize_query(query)
+        documents = self._get(key)
+        if documents is not None:
+            self.hits += 1
+            CACHE_LOOKUPS.labels("web_search", "hit").inc()
+            return list(documents)
+
+        task = self._pending.get(key)
+        if task is not None:
+            self.hits += 1
+            CACHE_LOOKUPS.labels("web_search", "hit").inc()
+            return list(await asyncio.shield(task) or [])
+
+        self.misses += 1
+        CACHE_LOOKUPS.labels("web_search", "miss").inc()
+        task = asyncio.ensure_future(self._fetch(query))
+        self._pending[key] = task
+        try:
+            documents = await asyncio.shield(task)
+            if documents is not None:
+                self._put(key, documents)
+        finally:
+            self._pending.pop(key, None)
+        return list(documents or [])
+
+
+_web_search = None
+
+
+def get_web_search():
+    """取得行程內共用的網路搜尋"""
+    global _web_search
+    if _web_search is None:
+        _web_search = WebSearch(
+            max_results=WEB_SEARCH_MAX_RESULTS,
+            ttl=WEB_SEARCH_CACHE_TTL,
+            max_entries=WEB_SEARCH_CACHE_MAX_ENTRIES,
+        )
+    return _web_search